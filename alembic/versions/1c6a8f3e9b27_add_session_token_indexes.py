@@ -0,0 +1,28 @@
+"""index session tokens for the sign-in claim
+
+Revision ID: 1c6a8f3e9b27
+Revises: 7b3f9e2c5d14
+Create Date: 2026-10-18 21:05:38.217460
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '1c6a8f3e9b27'
+down_revision: Union[str, None] = '7b3f9e2c5d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # signing in moves the visitor's addresses and orders over by session token; cart.session_token is unique already
+    op.create_index(op.f('ix_addresses_session_token'), 'addresses', ['session_token'])
+    op.create_index(op.f('ix_order_session_token'), 'order', ['session_token'])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_order_session_token'), table_name='order')
+    op.drop_index(op.f('ix_addresses_session_token'), table_name='addresses')
@@ -0,0 +1,26 @@
+"""add category index to products
+
+Revision ID: 2c9e4f6a1d37
+Revises: b7f3c1a8d205
+Create Date: 2026-10-18 15:10:26.497730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '2c9e4f6a1d37'
+down_revision: Union[str, None] = 'b7f3c1a8d205'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # grouped product counts per category and /category/{id}/products pages ordered by (updated_at, id)
+    op.create_index('ix_products_category_id_updated_at', 'products', ['category_id', 'updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_category_id_updated_at', table_name='products')
@@ -0,0 +1,31 @@
+"""add keyset pagination indexes
+
+Revision ID: 3a7e1c52d9f4
+Revises: 14d57119abc8
+Create Date: 2026-10-18 10:12:41.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a7e1c52d9f4'
+down_revision: Union[str, None] = '14d57119abc8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # cursor pages order by (updated_at DESC, id DESC); a backward scan of these indexes serves them
+    op.create_index('ix_products_updated_at_id', 'products', ['updated_at', 'id'])
+    op.create_index('ix_categories_updated_at_id', 'categories', ['updated_at', 'id'])
+    op.create_index('ix_users_updated_at_id', 'users', ['updated_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_updated_at_id', table_name='users')
+    op.drop_index('ix_categories_updated_at_id', table_name='categories')
+    op.drop_index('ix_products_updated_at_id', table_name='products')
@@ -0,0 +1,42 @@
+"""add sharded stock counters for hot products
+
+Revision ID: 4e8b1d6c2a95
+Revises: 9a6e2d5b8f41
+Create Date: 2026-10-18 18:02:47.519204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4e8b1d6c2a95'
+down_revision: Union[str, None] = '9a6e2d5b8f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('stock_shards', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.create_table(
+        'product_stock_shards',
+        sa.Column('product_id', sa.UUID(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('stock', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id', 'shard'),
+    )
+
+
+def downgrade() -> None:
+    # fold any sharded stock back into the product rows before the shards go away
+    op.execute(
+        "UPDATE products SET stock = s.total FROM "
+        "(SELECT product_id, sum(stock) AS total FROM product_stock_shards GROUP BY product_id) s "
+        "WHERE products.id = s.product_id"
+    )
+    op.drop_table('product_stock_shards')
+    op.drop_column('products', 'stock_shards')
@@ -0,0 +1,28 @@
+"""add content hash to product photos
+
+Revision ID: 5d2a9e7c4b18
+Revises: 8c4b2f0e6a13
+Create Date: 2026-10-18 13:05:44.271906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2a9e7c4b18'
+down_revision: Union[str, None] = '8c4b2f0e6a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # photos uploaded before this revision keep a NULL hash
+    op.add_column('product_photos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_product_photos_content_hash'), 'product_photos', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_product_photos_content_hash'), table_name='product_photos')
+    op.drop_column('product_photos', 'content_hash')
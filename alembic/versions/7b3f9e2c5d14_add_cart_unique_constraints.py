@@ -0,0 +1,61 @@
+"""one cart per user and one cart line per product
+
+Revision ID: 7b3f9e2c5d14
+Revises: 4e8b1d6c2a95
+Create Date: 2026-10-18 18:47:12.904513
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3f9e2c5d14'
+down_revision: Union[str, None] = '4e8b1d6c2a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a user's extra carts are folded into their oldest one
+    op.execute(
+        "WITH ranked AS ("
+        " SELECT id, first_value(id) OVER (PARTITION BY user_id ORDER BY created_at, id) AS keep"
+        " FROM cart WHERE user_id IS NOT NULL) "
+        "UPDATE cart_item SET cart_id = ranked.keep FROM ranked "
+        "WHERE cart_item.cart_id = ranked.id AND ranked.id <> ranked.keep"
+    )
+    op.execute(
+        "WITH ranked AS ("
+        " SELECT id, first_value(id) OVER (PARTITION BY user_id ORDER BY created_at, id) AS keep"
+        " FROM cart WHERE user_id IS NOT NULL) "
+        "DELETE FROM cart USING ranked WHERE cart.id = ranked.id AND ranked.id <> ranked.keep"
+    )
+    # repeated lines of one product become one line carrying their summed quantity and price
+    op.execute(
+        "WITH ranked AS ("
+        " SELECT id, first_value(id) OVER w AS keep, sum(quantity) OVER w AS quantity, sum(price) OVER w AS price"
+        " FROM cart_item WHERE cart_id IS NOT NULL"
+        " WINDOW w AS (PARTITION BY cart_id, product_id ORDER BY created_at, id"
+        " ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)) "
+        "UPDATE cart_item SET quantity = ranked.quantity, price = ranked.price FROM ranked "
+        "WHERE cart_item.id = ranked.id AND ranked.id = ranked.keep"
+    )
+    op.execute(
+        "WITH ranked AS ("
+        " SELECT id, first_value(id) OVER (PARTITION BY cart_id, product_id ORDER BY created_at, id) AS keep"
+        " FROM cart_item WHERE cart_id IS NOT NULL) "
+        "DELETE FROM cart_item USING ranked WHERE cart_item.id = ranked.id AND ranked.id <> ranked.keep"
+    )
+    # totals are maintained by deltas from now on, so they start out exact
+    op.execute(
+        "UPDATE cart SET total_price = coalesce((SELECT sum(price) FROM cart_item WHERE cart_item.cart_id = cart.id), 0)"
+    )
+    op.create_unique_constraint('uq_cart_user_id', 'cart', ['user_id'])
+    op.create_unique_constraint('uq_cart_item_cart_id_product_id', 'cart_item', ['cart_id', 'product_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_cart_item_cart_id_product_id', 'cart_item', type_='unique')
+    op.drop_constraint('uq_cart_user_id', 'cart', type_='unique')
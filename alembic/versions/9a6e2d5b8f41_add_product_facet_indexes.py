@@ -0,0 +1,30 @@
+"""add product facet filter indexes
+
+Revision ID: 9a6e2d5b8f41
+Revises: f58d2b4e7c90
+Create Date: 2026-10-18 16:41:03.377265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '9a6e2d5b8f41'
+down_revision: Union[str, None] = 'f58d2b4e7c90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_products_category_id_price', 'products', ['category_id', 'price', 'stock'], unique=False)
+    op.create_index('ix_products_price', 'products', ['price'], unique=False)
+    op.create_index('ix_products_in_stock_updated_at', 'products', ['updated_at', 'id'], unique=False,
+                    postgresql_where=sa.text('stock > 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_in_stock_updated_at', table_name='products')
+    op.drop_index('ix_products_price', table_name='products')
+    op.drop_index('ix_products_category_id_price', table_name='products')
@@ -0,0 +1,26 @@
+"""add product_id index to product photos
+
+Revision ID: b7f3c1a8d205
+Revises: e41b7d3f9a62
+Create Date: 2026-10-18 14:32:51.118034
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7f3c1a8d205'
+down_revision: Union[str, None] = 'e41b7d3f9a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # listings load the photos of a whole page with product_id = ANY(...)
+    op.create_index(op.f('ix_product_photos_product_id'), 'product_photos', ['product_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_product_photos_product_id'), table_name='product_photos')
@@ -0,0 +1,26 @@
+"""add variants to product photos
+
+Revision ID: e41b7d3f9a62
+Revises: 5d2a9e7c4b18
+Create Date: 2026-10-18 13:48:12.604519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7d3f9a62'
+down_revision: Union[str, None] = '5d2a9e7c4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('product_photos', sa.Column('variants', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('product_photos', 'variants')
@@ -0,0 +1,37 @@
+"""add parent and materialized path to categories
+
+Revision ID: f58d2b4e7c90
+Revises: 2c9e4f6a1d37
+Create Date: 2026-10-18 15:52:39.804116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f58d2b4e7c90'
+down_revision: Union[str, None] = '2c9e4f6a1d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('categories', sa.Column('parent_id', sa.Uuid(), nullable=True))
+    op.create_foreign_key('categories_parent_id_fkey', 'categories', 'categories', ['parent_id'], ['id'])
+    op.create_index(op.f('ix_categories_parent_id'), 'categories', ['parent_id'], unique=False)
+    # existing categories become roots
+    op.add_column('categories', sa.Column('path', sa.String(), nullable=True))
+    op.execute('UPDATE categories SET path = id::text')
+    op.alter_column('categories', 'path', nullable=False)
+    op.create_index('ix_categories_path', 'categories', ['path'], unique=False,
+                    postgresql_ops={'path': 'varchar_pattern_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_categories_path', table_name='categories')
+    op.drop_column('categories', 'path')
+    op.drop_index(op.f('ix_categories_parent_id'), table_name='categories')
+    op.drop_constraint('categories_parent_id_fkey', 'categories', type_='foreignkey')
+    op.drop_column('categories', 'parent_id')
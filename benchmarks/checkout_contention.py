@@ -0,0 +1,108 @@
+"""Concurrent checkouts of one SKU against the stock reservation engine.
+
+Creates a throwaway category and product, lets --buyers checkouts race for --stock units through
+reserve_stock, each in its own transaction that holds the row lock for --hold-ms (standing in for
+the rest of create_order), and reports throughput, latency and whether anything was oversold.
+--shards N runs the same race against sharded stock; compare --shards 0, 4, 16 for the scaling.
+
+    python -m benchmarks.checkout_contention --stock 500 --buyers 2000 --concurrency 24 --shards 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+from sqlalchemy import delete, select
+
+import src.main  # noqa: F401  registers every mapped class
+from src.category.models import Category
+from src.product.models import Product
+from src.product.stock import rebalance, reserve_stock, set_stock_shards
+from src.utils.exceptions import OutOfStockError, StockBusyError
+from src.utils.single_psql_db import close_psql_db, get_db
+
+
+async def _setup(stock: int, shards: int) -> tuple:
+    category_id, product_id = uuid4(), uuid4()
+    async with get_db() as db:
+        db.add(Category(id=category_id, name="benchmark", description="checkout contention", path=str(category_id)))
+        await db.flush()
+        db.add(Product(id=product_id, title="benchmark sku", description="checkout contention", price=1.0,
+                       stock=stock, is_active=True, category_id=category_id))
+        await db.flush()
+        if shards:
+            await set_stock_shards(db, product_id, shards)
+        await db.commit()
+    return category_id, product_id
+
+
+async def _teardown(category_id, product_id):
+    async with get_db() as db:
+        await db.execute(delete(Product).where(Product.id == product_id))
+        await db.execute(delete(Category).where(Category.id == category_id))
+        await db.commit()
+
+
+async def _checkout(product_id, quantity: int, hold: float, results: dict, latencies: list):
+    started = time.perf_counter()
+    async with get_db() as db:
+        try:
+            await reserve_stock(db, {product_id: quantity})
+            if hold:
+                await asyncio.sleep(hold)
+            await db.commit()
+            results["sold"] += 1
+        except OutOfStockError:
+            await db.rollback()
+            results["out_of_stock"] += 1
+        except StockBusyError:
+            await db.rollback()
+            results["busy"] += 1
+    latencies.append(time.perf_counter() - started)
+
+
+async def main(stock: int, buyers: int, quantity: int, concurrency: int, hold_ms: float, shards: int):
+    category_id, product_id = await _setup(stock, shards)
+    results = {"sold": 0, "out_of_stock": 0, "busy": 0}
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def buyer():
+        async with gate:
+            await _checkout(product_id, quantity, hold_ms / 1000, results, latencies)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(buyer() for _ in range(buyers)))
+        elapsed = time.perf_counter() - started
+        async with get_db() as db:
+            # folds the shards into Product.stock, as the background rebalancer would
+            await rebalance(db, product_id)
+            await db.commit()
+            left = await db.scalar(select(Product.stock).where(Product.id == product_id))
+    finally:
+        await _teardown(category_id, product_id)
+        await close_psql_db()
+
+    latencies.sort()
+    print(f"buyers={buyers} concurrency={concurrency} quantity={quantity} hold={hold_ms}ms shards={shards}")
+    print(f"sold={results['sold']} out_of_stock={results['out_of_stock']} busy={results['busy']} "
+          f"stock {stock} -> {left}")
+    print(f"{buyers / elapsed:.0f} checkouts/s, {results['sold'] / elapsed:.0f} sales/s over {elapsed:.2f}s")
+    print(f"latency p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms")
+    oversold = left < 0 or results["sold"] * quantity != stock - left
+    print("OVERSOLD" if oversold else "no oversell")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent checkouts of a single product.")
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=2000)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=24)
+    parser.add_argument("--hold-ms", type=float, default=5.0)
+    parser.add_argument("--shards", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.stock, args.buyers, args.quantity, args.concurrency, args.hold_ms, args.shards))
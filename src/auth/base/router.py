@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Depends
+from typing import Optional
+
+from fastapi import APIRouter, Cookie, Depends
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.base.schemas import LoginSchema, RegisterSchema, ChangePassword
 from src.users.models import User
@@ -10,6 +13,7 @@ from src.auth.current_user import get_current_user
 from src.users.service import UserService
 
 from src.settings import config
+from src.utils.single_psql_db import get_session
 
 auth = APIRouter(
     prefix="/auth",
@@ -19,8 +23,9 @@ auth = APIRouter(
 
 
 @auth.post("/sign-in")
-async def login(loginSchema: LoginSchema):
-    content = await AuthService.login(loginSchema)
+async def login(loginSchema: LoginSchema, session_token: Optional[str] = Cookie(None),
+                db: AsyncSession = Depends(get_session)):
+    content = await AuthService.login(db, loginSchema, session_token)
     resp = JSONResponse(status_code=content.status, content=content.model_dump())
     resp.set_cookie("Authorization", value=content.details["token"],
                     max_age=60 * config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -28,8 +33,9 @@ async def login(loginSchema: LoginSchema):
 
 
 @auth.post("/sign-up")
-async def register(registerSchema: RegisterSchema):
-    content = await AuthService.register(registerSchema)
+async def register(registerSchema: RegisterSchema, session_token: Optional[str] = Cookie(None),
+                   db: AsyncSession = Depends(get_session)):
+    content = await AuthService.register(db, registerSchema, session_token)
     resp = JSONResponse(status_code=content.status, content=content.model_dump())
     resp.set_cookie("Authorization", value=content.details["token"],
                     max_age=60 * config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -57,8 +63,9 @@ async def forgot_password():
 
 
 @auth.post("/change-password")
-async def change_password(change_schema: ChangePassword, current_user: User = Depends(get_current_user)):
-    content = await AuthService.change_password(change_schema, current_user)
+async def change_password(change_schema: ChangePassword, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    content = await AuthService.change_password(db, change_schema, current_user)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
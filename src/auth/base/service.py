@@ -1,16 +1,19 @@
 from src.auth.base.schemas import RegisterSchema, LoginSchema, ChangePassword
+from src.cart.store import cart_store
 
 from src.utils.schemas import GeneralResponse
 from src.utils.exceptions import AuthError, NotFoundError
-from src.utils.single_psql_db import get_db
 
 from src.users.schemas import UserCreate, UserMeView, UserMiniView
+from src.users.claims import claim_anonymous
 from src.users.models import User
 
 from src.settings import config
 
 from datetime import datetime, timedelta
 from jose import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 
 import bcrypt
 
@@ -23,10 +26,13 @@ def verify_password(plain_password, hashed_password):
 class AuthService:
 
     @staticmethod
-    async def register(register_schema: RegisterSchema):
+    async def register(db: AsyncSession, register_schema: RegisterSchema, session_token: Optional[str] = None):
         new_user = UserCreate(**register_schema.model_dump())
         print("k")
-        user = await User.create(new_user)
+        user = await User.create(db, new_user)
+        # the cart, addresses and orders made before signing up move to the new account
+        await cart_store.flush(db, session_token)
+        await claim_anonymous(db, user, session_token)
         access_token = AuthService.create_access_token(
             data={"sub": user.email}, expires_delta=config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
         )
@@ -37,8 +43,8 @@ class AuthService:
         })
 
     @staticmethod
-    async def authenticate(identifier: str, password: str):
-        user = await User.by_email(identifier)
+    async def authenticate(db: AsyncSession, identifier: str, password: str):
+        user = await User.by_email(db, identifier)
         if not user:
             raise NotFoundError("User not found")
         if user.is_active is False:
@@ -56,9 +62,11 @@ class AuthService:
         return encoded_jwt
 
     @staticmethod
-    async def login(login_schema: LoginSchema):
-        user = await AuthService.authenticate(identifier=login_schema.identifier,
+    async def login(db: AsyncSession, login_schema: LoginSchema, session_token: Optional[str] = None):
+        user = await AuthService.authenticate(db, identifier=login_schema.identifier,
                                               password=login_schema.password.get_secret_value())
+        await cart_store.flush(db, session_token)
+        await claim_anonymous(db, user, session_token)
         access_token = AuthService.create_access_token(
             data={"sub": user.email}, expires_delta=config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
         )
@@ -106,12 +114,11 @@ class AuthService:
     #         return GeneralResponse(status=200, message="Logged in successfully", details=access_token)
 
     @staticmethod
-    async def change_password(change_schema: ChangePassword, actor: User):
+    async def change_password(db: AsyncSession, change_schema: ChangePassword, actor: User):
         if not verify_password(change_schema.old_password.get_secret_value(), actor.password):
             raise AuthError("Şifreler eşleşmiyor.")
-        async with get_db() as db:
-            user = await db.get(User, actor.id)
-            user.password = bcrypt.hashpw(change_schema.new_password.get_secret_value().encode('utf-8'),
-                                          bcrypt.gensalt()).decode('utf-8')
-            await db.commit()
+        user = await db.get(User, actor.id)
+        user.password = bcrypt.hashpw(change_schema.new_password.get_secret_value().encode('utf-8'),
+                                      bcrypt.gensalt()).decode('utf-8')
+        await db.flush()
         return GeneralResponse(status=200, message="Şifre başarıyla değiştirildi.")
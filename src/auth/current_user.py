@@ -1,7 +1,10 @@
 from src.utils.exceptions import AuthError
-from fastapi import Cookie, Request, Header
+from fastapi import Cookie, Request, Header, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from src.settings import config
 from src.users.models import User
+from src.utils.single_psql_db import get_session
 
 from datetime import datetime
 from jose import JWTError, jwt
@@ -10,7 +13,8 @@ from pydantic import ValidationError
 
 async def get_current_user(
         Authorization: str = Cookie(None),
-        authorization: str = Header(None, alias="Authorization")
+        authorization: str = Header(None, alias="Authorization"),
+        db: AsyncSession = Depends(get_session)
 ) -> User:
     token = None
 
@@ -37,7 +41,7 @@ async def get_current_user(
         if email is None:
             raise AuthError("Geçersiz token formatı.")
 
-        user = await User.by_email(email)
+        user = await User.by_email(db, email)
         if user is None:
             return None
 
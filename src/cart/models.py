@@ -1,7 +1,13 @@
+from typing import List, Optional, Tuple
+
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Integer, UniqueConstraint, all_, bindparam, delete, exists, func, literal, select, \
+    update
+from sqlalchemy.dialects.postgresql import ARRAY, insert, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
 
+from src.product.models import Product
 from src.utils.single_psql_db import Base
 
 
@@ -13,12 +19,46 @@ class Cart(Base):
     session_token: Mapped[str] = mapped_column(unique=True, nullable=True)
     total_price: Mapped[float] = mapped_column(default=0.0)
 
+    __table_args__ = (
+        # one cart per user; also the arbiter of the get-or-create upsert
+        UniqueConstraint("user_id", name="uq_cart_user_id"),
+    )
+
     items: Mapped[list["CartItem"]] = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
     user: Mapped["User"] = relationship("User", back_populates="cart")
 
+    @staticmethod
+    def owner(user_id: Optional[UUID], session_token: Optional[str]):
+        return Cart.user_id == user_id if user_id else Cart.session_token == session_token
+
+    @classmethod
+    async def upsert(cls, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                     cart_id: Optional[UUID] = None) -> UUID:
+        """Returns the id of the owner's cart, creating it if needed, and locks it until commit.
+
+        The lock serializes writes to one cart, so the total_price deltas of concurrent requests
+        are applied one after the other. User carts are keyed by user only.
+        """
+        stmt = insert(cls).values(id=cart_id or uuid4(), user_id=user_id, session_token=None if user_id else session_token,
+                                  total_price=0.0)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.user_id] if user_id else [cls.session_token],
+            set_={"updated_at": stmt.excluded.updated_at},
+        ).returning(cls.id)
+        return await db.scalar(stmt)
+
+    @classmethod
+    async def lock(cls, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]) -> Optional[UUID]:
+        # an existing cart's id, locked like upsert() does; None when there is no cart
+        return await db.scalar(select(cls.id).where(cls.owner(user_id, session_token)).with_for_update())
+
 
 class CartItem(Base):
     __tablename__ = "cart_item"
+    __table_args__ = (
+        # one line per product: adding it again raises the quantity (ON CONFLICT arbiter)
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_item_cart_id_product_id"),
+    )
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     cart_id: Mapped[UUID] = mapped_column(ForeignKey("cart.id"), nullable=True)
@@ -29,3 +69,101 @@ class CartItem(Base):
 
     cart: Mapped["Cart"] = relationship("Cart", back_populates="items")
     product: Mapped["Product"] = relationship("Product")
+
+    # The writes below change one line and move cart.total_price by the line's price difference in the same
+    # statement: the old line is read from the statement snapshot, taken after Cart.upsert/lock got the cart
+    # row, so no concurrent write to this cart can slip in between. Each returns the new total, or None when
+    # nothing matched.
+
+    @classmethod
+    async def add(cls, db: AsyncSession, cart_id: UUID, product_id: UUID, quantity: int) -> Optional[float]:
+        """Adds quantity of the product to the cart, repricing the line at the current product price."""
+        product = select(Product.id, Product.price, Product.title).where(Product.id == product_id).cte("product")
+        old = select(cls.price).where(cls.cart_id == cart_id, cls.product_id == product_id).cte("old")
+        now = func.timezone("utc", func.now())
+        stmt = insert(cls).from_select(
+            ["id", "cart_id", "product_id", "quantity", "price", "title", "created_at", "updated_at"],
+            select(literal(uuid4(), PG_UUID), literal(cart_id, PG_UUID), product.c.id, literal(quantity),
+                   product.c.price * quantity, product.c.title, now, now),
+        )
+        quantity_after = cls.quantity + stmt.excluded.quantity
+        item = stmt.on_conflict_do_update(
+            index_elements=[cls.cart_id, cls.product_id],
+            set_={"quantity": quantity_after, "price": select(product.c.price).scalar_subquery() * quantity_after,
+                  "title": stmt.excluded.title, "updated_at": now},
+        ).returning(cls.price).cte("item")
+        return await cls._apply_delta(db, cart_id, item, old)
+
+    @classmethod
+    async def set_quantity(cls, db: AsyncSession, cart_id: UUID, item_id: UUID, quantity: int) -> Optional[float]:
+        old = select(cls.price).where(cls.id == item_id, cls.cart_id == cart_id).cte("old")
+        item = (
+            update(cls)
+            .where(cls.id == item_id, cls.cart_id == cart_id)
+            .values(quantity=quantity,
+                    price=select(Product.price).where(Product.id == cls.product_id).scalar_subquery() * quantity,
+                    updated_at=func.timezone("utc", func.now()))
+            .returning(cls.price)
+            .cte("item")
+        )
+        return await cls._apply_delta(db, cart_id, item, old)
+
+    @classmethod
+    async def remove(cls, db: AsyncSession, cart_id: UUID, item_id: UUID) -> Optional[float]:
+        old = select(cls.price).where(cls.id == item_id, cls.cart_id == cart_id).cte("old")
+        item = (
+            delete(cls)
+            .where(cls.id == item_id, cls.cart_id == cart_id)
+            .returning(literal(0.0).label("price"))
+            .cte("item")
+        )
+        return await cls._apply_delta(db, cart_id, item, old)
+
+    @classmethod
+    async def _apply_delta(cls, db: AsyncSession, cart_id: UUID, item, old) -> Optional[float]:
+        delta = select(item.c.price - func.coalesce(select(old.c.price).scalar_subquery(), 0.0)).scalar_subquery()
+        stmt = (
+            update(Cart)
+            .where(Cart.id == cart_id, exists(select(item.c.price)))
+            .values(total_price=Cart.total_price + delta)
+            .returning(Cart.total_price)
+            .add_cte(item)
+            .execution_options(synchronize_session=False)
+        )
+        return await db.scalar(stmt)
+
+    @classmethod
+    async def replace(cls, db: AsyncSession, cart_id: UUID, lines: List[Tuple[UUID, UUID, int]]):
+        """Makes the cart hold exactly lines, (item id, product id, quantity) triples, priced at the current
+        product prices; lines of deleted products are dropped. Three statements whatever the cart size."""
+        ids, product_ids, quantities = (list(column) for column in zip(*lines)) if lines else ([], [], [])
+        await db.execute(delete(cls).where(
+            cls.cart_id == cart_id,
+            cls.product_id != all_(bindparam("product_ids", product_ids, type_=ARRAY(PG_UUID))),
+        ))
+        rows = select(
+            func.unnest(bindparam("ids", ids, type_=ARRAY(PG_UUID(as_uuid=True))),
+                        bindparam("line_product_ids", product_ids, type_=ARRAY(PG_UUID(as_uuid=True))),
+                        bindparam("quantities", quantities, type_=ARRAY(Integer)))
+            .table_valued("id", "product_id", "quantity")
+            .render_derived(with_types=False)
+        ).subquery("lines")
+        now = func.timezone("utc", func.now())
+        stmt = insert(cls).from_select(
+            ["id", "cart_id", "product_id", "quantity", "price", "title", "created_at", "updated_at"],
+            select(rows.c.id, literal(cart_id, PG_UUID), Product.id, rows.c.quantity, Product.price * rows.c.quantity,
+                   Product.title, now, now)
+            .join_from(rows, Product, Product.id == rows.c.product_id),
+        )
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[cls.cart_id, cls.product_id],
+            set_={"quantity": stmt.excluded.quantity, "price": stmt.excluded.price, "title": stmt.excluded.title,
+                  "updated_at": now},
+        ))
+        await db.execute(
+            update(Cart)
+            .where(Cart.id == cart_id)
+            .values(total_price=select(func.coalesce(func.sum(cls.price), 0.0))
+                    .where(cls.cart_id == cart_id).scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
@@ -2,13 +2,15 @@ from typing import Optional
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, Cookie
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from starlette.responses import JSONResponse
 
 from src.auth.current_user import get_current_user
-from src.cart.schemas import CartItemCreate
+from src.cart.schemas import CartBatch, CartItemCreate
 from src.cart.service import CartService
 from src.users.models import User
+from src.utils.single_psql_db import get_session
 
 cart = APIRouter(
     prefix="/cart",
@@ -18,30 +20,42 @@ cart = APIRouter(
 
 
 @cart.get("")
-async def cart_view(user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
-    resp = await CartService.cart_get(user, session_token)
+async def cart_view(user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                    db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_get(db, user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @cart.post("")
-async def cart_add_item(item: CartItemCreate, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
-    resp = await CartService.cart_add_item(item, user, session_token)
+async def cart_add_item(item: CartItemCreate, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                        db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_add_item(db, item, user, session_token)
+    return JSONResponse(status_code=resp.status, content=resp.model_dump())
+
+
+@cart.patch("")
+async def cart_batch(batch: CartBatch, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                     db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_batch(db, batch, user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @cart.put("/{item_id}")
-async def cart_update_item(item_id: UUID, quantity: int, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
-    resp = await CartService.cart_update_item_quantity(item_id, quantity, user, session_token)
+async def cart_update_item(item_id: UUID, quantity: int, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                           db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_update_item_quantity(db, item_id, quantity, user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @cart.delete("/{item_id}")
-async def cart_remove_item(item_id: UUID, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
-    resp = await CartService.cart_remove_item(item_id, user, session_token)
+async def cart_remove_item(item_id: UUID, user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                           db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_remove_item(db, item_id, user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @cart.delete("")
-async def cart_clear(user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
-    resp = await CartService.cart_clear(user, session_token)
+async def cart_clear(user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                     db: AsyncSession = Depends(get_session)):
+    resp = await CartService.cart_clear(db, user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
\ No newline at end of file
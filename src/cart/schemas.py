@@ -1,4 +1,6 @@
-from pydantic import BaseModel, Field
+from enum import Enum
+
+from pydantic import BaseModel, Field, model_validator
 from uuid import UUID
 from typing import List, Optional, Union
 
@@ -43,3 +45,31 @@ class CartView(BaseModel, UUIDView):
     class Config:
         orm_mode = True
         from_attributes = True
+
+
+class CartOperationType(str, Enum):
+    ADD = "add"
+    SET = "set"
+    REMOVE = "remove"
+
+
+class CartOperation(BaseModel):
+    # add: product_id + quantity; set: item_id or product_id + quantity; remove: item_id or product_id
+    op: CartOperationType
+    product_id: Optional[UUID] = None
+    item_id: Optional[UUID] = None
+    quantity: Optional[int] = Field(default=None, gt=0, description="Ürün miktarı en az 1 olmalıdır.")
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.op == CartOperationType.ADD and self.product_id is None:
+            raise ValueError("Eklenecek ürün belirtilmeli.")
+        if self.op != CartOperationType.ADD and (self.product_id is None) == (self.item_id is None):
+            raise ValueError("item_id veya product_id alanlarından biri belirtilmeli.")
+        if self.op != CartOperationType.REMOVE and self.quantity is None:
+            raise ValueError("Miktar belirtilmeli.")
+        return self
+
+
+class CartBatch(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
@@ -1,226 +1,142 @@
+import asyncio
+import logging
+
 from starlette import status
 
-from src.cart.models import CartItem, Cart
-from src.cart.schemas import CartItemCreate, CartView, CartItemView
-from src.product.models import Product
+from src.cart.schemas import CartBatch, CartItemCreate
+from src.cart.store import cart_store
 
-from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
+from src.settings import config
 from src.users.models import User
 from src.utils.exceptions import BadRequestError
 from src.utils.schemas import GeneralResponse
 from src.utils.single_psql_db import get_db
 
+logger = logging.getLogger(__name__)
 
-class CartService:
-
-    @staticmethod
-    async def cart_add_item(item: CartItemCreate, actor: User = None, session_token: str = None):
-        async with get_db() as db:
-            try:
-                user_id = actor.id if actor else None
-
-                product = await db.scalar(select(Product).where(Product.id == item.product_id))
-                if not product:
-                    raise BadRequestError("Ürün bulunamadı.")
-
-                if user_id:
-                    cart = await db.scalar(select(Cart).where(Cart.user_id == user_id))
-                else:
-                    cart = await db.scalar(select(Cart).where(Cart.session_token == session_token))
-
-                if not cart:
-                    cart = Cart(user_id=user_id, session_token=session_token)
-                    db.add(cart)
-                    await db.flush()
-
-                existing_cart_item = await db.scalar(
-                    select(CartItem).where(CartItem.cart_id == cart.id, CartItem.product_id == product.id)
-                )
-                if existing_cart_item:
-                    existing_cart_item.quantity += item.quantity
-                    existing_cart_item.price = float(product.price) * existing_cart_item.quantity
-                else:
-                    db.add(
-                        CartItem(
-                            cart_id=cart.id,
-                            product_id=product.id,
-                            quantity=item.quantity,
-                            price=float(product.price) * item.quantity,
-                            title=product.title,
-                        )
-                    )
-
-                cart_items = await db.scalars(select(CartItem).where(CartItem.cart_id == cart.id))
-                cart.total_price = sum(item.price for item in cart_items)
-                await db.commit()
 
-                return GeneralResponse(
-                    status_code=status.HTTP_201_CREATED, message="Ürün sepete eklendi."
-                )
-            except Exception as e:
-                await db.rollback()
-                raise BadRequestError(f"Ürün sepete eklenirken bir hata oluştu: {str(e)}")
+class CartService:
 
     @staticmethod
-    async def cart_remove_item(item_id: UUID, actor: User = None, session_token: str = None):
-        async with get_db() as db:
-            async with db.begin():
-                try:
-                    user_id = actor.id if actor else None
+    async def cart_add_item(db: AsyncSession, item: CartItemCreate, actor: User = None, session_token: str = None):
+        try:
+            user_id = actor.id if actor else None
+            if not user_id and not session_token:
+                raise BadRequestError("Oturum bulunamadı.")
 
-                    cart = await db.scalar(
-                        select(Cart).where(
-                            Cart.user_id == user_id if user_id else Cart.session_token == session_token
-                        )
-                    )
+            await cart_store.add(db, user_id, session_token, item.product_id, item.quantity)
 
-                    if not cart:
-                        raise BadRequestError("Sepet bulunamadı.")
+            return GeneralResponse(
+                status_code=status.HTTP_201_CREATED, message="Ürün sepete eklendi."
+            )
+        except Exception as e:
+            await db.rollback()
+            raise BadRequestError(f"Ürün sepete eklenirken bir hata oluştu: {str(e)}")
 
-                    cart_item = await db.scalar(
-                        select(CartItem).where(
-                            CartItem.id == item_id,
-                            CartItem.cart_id == cart.id
-                        )
-                    )
+    @staticmethod
+    async def cart_remove_item(db: AsyncSession, item_id: UUID, actor: User = None, session_token: str = None):
+        try:
+            user_id = actor.id if actor else None
 
-                    if not cart_item:
-                        raise BadRequestError("Ürün bulunamadı.")
+            await cart_store.remove(db, user_id, session_token, item_id)
 
-                    await db.delete(cart_item)
-                    await db.flush()
+            return GeneralResponse(
+                status_code=status.HTTP_200_OK,
+                message="Ürün sepetten silindi."
+            )
 
-                    cart.total_price = sum(
-                        item.price for item in cart.items
-                    )
+        except Exception as e:
+            await db.rollback()
+            raise BadRequestError(f"Sepetten ürün çıkarılırken bir hata oluştu: {str(e)}")
 
-                    await db.flush()
+    @staticmethod
+    async def cart_get(db: AsyncSession, actor: User = None, session_token: str = None):
+        try:
+            user_id = actor.id if actor else None
 
-                    return GeneralResponse(
-                        status_code=status.HTTP_200_OK,
-                        message="Ürün sepetten silindi."
-                    )
+            cart_view = await cart_store.get(db, user_id, session_token)
 
-                except Exception as e:
-                    await db.rollback()
-                    raise BadRequestError(f"Sepetten ürün çıkarılırken bir hata oluştu: {str(e)}")
+            return GeneralResponse(status_code=status.HTTP_200_OK, message="Sepet Listelendi.", details=cart_view)
 
-    @staticmethod
-    async def cart_get(actor: User = None, session_token: str = None):
-        async with get_db() as db:
-            async with db.begin():
-                try:
-                    user_id = actor.id if actor else None
-
-                    cart = await db.scalar(
-                        select(Cart).where(
-                            Cart.user_id == user_id if user_id else Cart.session_token == session_token
-                        )
-                    )
-
-                    if not cart:
-                        raise BadRequestError("Sepet bulunamadı.")
-
-                    cart_items = await db.scalars(
-                        select(CartItem).where(CartItem.cart_id == cart.id)
-                    )
-
-                    items_view = [
-                        CartItemView(
-                            id=str(item.id),
-                            product_id=str(item.product_id),
-                            quantity=item.quantity,
-                            price=item.price,
-                            title=item.title
-                        ) for item in cart_items
-                    ]
-
-                    return GeneralResponse(status_code=status.HTTP_200_OK, message="Sepet Listelendi.", details=CartView(
-                        id=str(cart.id),
-                        user_id=str(cart.user_id) if cart.user_id else None,
-                        session_token=cart.session_token,
-                        items=items_view,
-                        total_price=cart.total_price
-                    ))
-
-                except Exception as e:
-                    raise BadRequestError(f"Sepet bilgisi getirilirken bir hata oluştu: {str(e)}")
+        except Exception as e:
+            raise BadRequestError(f"Sepet bilgisi getirilirken bir hata oluştu: {str(e)}")
 
     @staticmethod
-    async def cart_clear(actor: User = None, session_token: str = None):
-        async with get_db() as db:
-            async with db.begin():
-                try:
-                    user_id = actor.id if actor else None
+    async def cart_clear(db: AsyncSession, actor: User = None, session_token: str = None):
+        try:
+            user_id = actor.id if actor else None
 
-                    cart = await db.scalar(
-                        select(Cart).where(
-                            Cart.user_id == user_id if user_id else Cart.session_token == session_token
-                        )
-                    )
+            await cart_store.clear(db, user_id, session_token)
 
-                    if not cart:
-                        raise BadRequestError("Sepet bulunamadı.")
+            return GeneralResponse(
+                status_code=status.HTTP_200_OK,
+                message="Sepet temizlendi."
+            )
 
-                    await db.delete(cart)
-                    await db.flush()
-
-                    return GeneralResponse(
-                        status_code=status.HTTP_200_OK,
-                        message="Sepet temizlendi."
-                    )
-
-                except Exception as e:
-                    await db.rollback()
-                    raise BadRequestError(f"Sepet temizlenirken bir hata oluştu: {str(e)}")
+        except Exception as e:
+            await db.rollback()
+            raise BadRequestError(f"Sepet temizlenirken bir hata oluştu: {str(e)}")
 
     @staticmethod
-    async def cart_update_item_quantity(item_id: UUID, quantity: int, actor: User = None, session_token: str = None):
-        async with get_db() as db:
-            async with db.begin():
-                try:
-                    if quantity <= 0:
-                        raise BadRequestError("Miktar sıfırdan büyük olmalıdır.")
+    async def cart_update_item_quantity(db: AsyncSession, item_id: UUID, quantity: int, actor: User = None, session_token: str = None):
+        try:
+            if quantity <= 0:
+                raise BadRequestError("Miktar sıfırdan büyük olmalıdır.")
 
-                    user_id = actor.id if actor else None
-                    filter_condition = (
-                        (Cart.user_id == user_id) if user_id else (Cart.session_token == session_token)
-                    )
+            user_id = actor.id if actor else None
 
-                    cart = await db.scalar(select(Cart).where(filter_condition))
-                    if not cart:
-                        raise BadRequestError("Sepet bulunamadı.")
+            await cart_store.set_quantity(db, user_id, session_token, item_id, quantity)
 
-                    cart_item = await db.scalar(
-                        select(CartItem).where(
-                            CartItem.id == item_id,
-                            CartItem.cart_id == cart.id
-                        )
-                    )
-                    if not cart_item:
-                        raise BadRequestError("Sepette bu ürüne ait öğe bulunamadı.")
+            return GeneralResponse(
+                status_code=status.HTTP_200_OK,
+                message="Ürün miktarı güncellendi."
+            )
 
-                    product = await db.scalar(select(Product).where(Product.id == cart_item.product_id))
-                    if not product:
-                        raise BadRequestError("Ürün bilgisi alınamadı.")
+        except Exception as e:
+            await db.rollback()
+            raise BadRequestError(f"Ürün miktarı güncellenirken bir hata oluştu: {str(e)}")
 
-                    cart_item.quantity = quantity
-                    cart_item.price = float(product.price) * quantity
+    @staticmethod
+    async def cart_batch(db: AsyncSession, batch: CartBatch, actor: User = None, session_token: str = None):
+        try:
+            user_id = actor.id if actor else None
+            if not user_id and not session_token:
+                raise BadRequestError("Oturum bulunamadı.")
 
-                    cart_items = await db.scalars(select(CartItem).where(CartItem.cart_id == cart.id))
-                    cart.total_price = sum(item.price for item in cart_items)
+            cart_view = await cart_store.apply(db, user_id, session_token, batch.operations)
 
-                    await db.flush()
+            return GeneralResponse(status=status.HTTP_200_OK, message="Sepet güncellendi.", details=cart_view)
 
-                    return GeneralResponse(
-                        status_code=status.HTTP_200_OK,
-                        message="Ürün miktarı güncellendi."
-                    )
+        except Exception as e:
+            await db.rollback()
+            raise BadRequestError(f"Sepet güncellenirken bir hata oluştu: {str(e)}")
 
-                except Exception as e:
-                    await db.rollback()
-                    raise BadRequestError(f"Ürün miktarı güncellenirken bir hata oluştu: {str(e)}")
+    @staticmethod
+    async def flush_cart(db: AsyncSession, session_token: str):
+        # moves a memory held anonymous cart into Postgres, e.g. before checkout or login
+        await cart_store.flush(db, session_token)
 
+    @staticmethod
+    async def sweep_carts():
+        # memory backend: drops abandoned carts and writes the long lived ones behind
+        while True:
+            await asyncio.sleep(config.cart_sweep_seconds)
+            for session_token in cart_store.sweep():
+                await CartService._flush_in_own_session(session_token)
 
+    @staticmethod
+    async def flush_all_carts():
+        for session_token in cart_store.tokens():
+            await CartService._flush_in_own_session(session_token)
+
+    @staticmethod
+    async def _flush_in_own_session(session_token: str):
+        try:
+            async with get_db() as db:
+                await cart_store.flush(db, session_token)
+                await db.commit()
+        except Exception:
+            logger.exception("cart flush failed")
@@ -0,0 +1,313 @@
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID, uuid4
+
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.cart.models import Cart, CartItem
+from src.cart.schemas import CartItemView, CartOperation, CartOperationType, CartView
+from src.product.models import Product
+from src.settings import config
+from src.utils.exceptions import BadRequestError
+from src.utils.single_psql_db import after_commit, read_only
+
+
+def apply_operations(quantities: Dict[UUID, int], item_products: Dict[UUID, UUID],
+                     operations: Iterable[CartOperation]) -> Dict[UUID, int]:
+    """Folds a batch into quantities (product id -> quantity) in order; item_products maps line ids to products."""
+    for operation in operations:
+        product_id = operation.product_id or item_products.get(operation.item_id)
+        if operation.op == CartOperationType.ADD:
+            quantities[product_id] = quantities.get(product_id, 0) + operation.quantity
+        elif product_id not in quantities:
+            raise BadRequestError("Sepette bu ürüne ait öğe bulunamadı.")
+        elif operation.op == CartOperationType.SET:
+            quantities[product_id] = operation.quantity
+        else:
+            del quantities[product_id]
+    return quantities
+
+
+@read_only
+async def _products(db: AsyncSession, product_ids: Iterable[UUID]) -> dict:
+    # price and title of every product in one query, from a replica when one is configured
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return {}
+    rows = await db.execute(
+        select(Product.id, Product.price, Product.title)
+        .where(Product.id == any_(bindparam("product_ids", product_ids, type_=ARRAY(PG_UUID))))
+    )
+    products = {row.id: row for row in rows}
+    if len(products) != len(product_ids):
+        raise BadRequestError("Ürün bulunamadı.")
+    return products
+
+
+class DatabaseCartStore:
+    """Carts in Postgres (Cart / CartItem); every read and write is a query."""
+
+    async def get(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]) -> CartView:
+        # populate_existing: writes earlier in this session went through SQL, not the ORM objects
+        cart = await db.scalar(
+            select(Cart).where(Cart.owner(user_id, session_token)).execution_options(populate_existing=True)
+        )
+        if not cart:
+            raise BadRequestError("Sepet bulunamadı.")
+        cart_items = await db.scalars(
+            select(CartItem).where(CartItem.cart_id == cart.id).execution_options(populate_existing=True)
+        )
+        return CartView(
+            id=str(cart.id),
+            user_id=str(cart.user_id) if cart.user_id else None,
+            session_token=cart.session_token,
+            items=[
+                CartItemView(id=str(item.id), product_id=str(item.product_id), quantity=item.quantity,
+                             price=item.price, title=item.title)
+                for item in cart_items
+            ],
+            total_price=cart.total_price,
+        )
+
+    async def add(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                  product_id: UUID, quantity: int):
+        cart_id = await Cart.upsert(db, user_id, session_token)
+        if await CartItem.add(db, cart_id, product_id, quantity) is None:
+            raise BadRequestError("Ürün bulunamadı.")
+
+    async def set_quantity(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                           item_id: UUID, quantity: int):
+        cart_id = await Cart.lock(db, user_id, session_token)
+        if not cart_id:
+            raise BadRequestError("Sepet bulunamadı.")
+        if await CartItem.set_quantity(db, cart_id, item_id, quantity) is None:
+            raise BadRequestError("Sepette bu ürüne ait öğe bulunamadı.")
+
+    async def remove(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str], item_id: UUID):
+        cart_id = await Cart.lock(db, user_id, session_token)
+        if not cart_id:
+            raise BadRequestError("Sepet bulunamadı.")
+        if await CartItem.remove(db, cart_id, item_id) is None:
+            raise BadRequestError("Ürün bulunamadı.")
+
+    async def clear(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]):
+        cart = await db.scalar(select(Cart).where(Cart.owner(user_id, session_token)))
+        if not cart:
+            raise BadRequestError("Sepet bulunamadı.")
+        await db.delete(cart)
+        await db.flush()
+
+    async def apply(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                    operations: List[CartOperation]) -> CartView:
+        """Applies a batch with a fixed number of statements: the cart, its lines, one product lookup and a
+        replace of the lines that also recomputes the total."""
+        if any(operation.op == CartOperationType.ADD for operation in operations):
+            cart_id = await Cart.upsert(db, user_id, session_token)
+        else:
+            cart_id = await Cart.lock(db, user_id, session_token)
+            if not cart_id:
+                raise BadRequestError("Sepet bulunamadı.")
+        items = list(await db.scalars(select(CartItem).where(CartItem.cart_id == cart_id)))
+        quantities = apply_operations({item.product_id: item.quantity for item in items},
+                                      {item.id: item.product_id for item in items}, operations)
+        await _products(db, [operation.product_id for operation in operations
+                             if operation.op == CartOperationType.ADD and operation.product_id in quantities])
+        item_ids = {item.product_id: item.id for item in items}
+        await CartItem.replace(db, cart_id, [(item_ids.get(product_id) or uuid4(), product_id, quantity)
+                                             for product_id, quantity in quantities.items()])
+        return await self.get(db, user_id, session_token)
+
+    async def flush(self, db: AsyncSession, session_token: Optional[str]):
+        # already in Postgres
+        pass
+
+
+@dataclass
+class MemoryCartLine:
+    id: UUID
+    product_id: UUID
+    quantity: int
+    price: float
+    title: str
+
+
+@dataclass
+class MemoryCart:
+    id: UUID = field(default_factory=uuid4)
+    lines: Dict[UUID, MemoryCartLine] = field(default_factory=dict)  # by product id
+    created_at: float = field(default_factory=time.monotonic)
+    touched_at: float = field(default_factory=time.monotonic)
+    version: int = 0
+
+    def touch(self):
+        self.touched_at = time.monotonic()
+        self.version += 1
+
+    def line(self, item_id: UUID) -> Optional[MemoryCartLine]:
+        return next((line for line in self.lines.values() if line.id == item_id), None)
+
+    def view(self, session_token: str) -> CartView:
+        lines = list(self.lines.values())
+        return CartView(
+            id=str(self.id),
+            session_token=session_token,
+            items=[
+                CartItemView(id=str(line.id), product_id=str(line.product_id), quantity=line.quantity,
+                             price=line.price, title=line.title)
+                for line in lines
+            ],
+            total_price=sum(line.price for line in lines),
+        )
+
+
+class MemoryCartStore:
+    """Anonymous carts kept in this process and written behind to Postgres.
+
+    A cart is flushed on checkout and login, and by the sweeper once it has been kept for
+    cart_flush_dwell_seconds; from then on it lives in Postgres. Carts left untouched for
+    cart_memory_ttl are dropped without ever reaching the database, which is what happens to most
+    of them. User carts, and anonymous carts already in Postgres, go to the database store.
+    Carts live in one worker: run a single worker or route a session to the same one.
+
+    Writes do their awaits (product reads) first and change the cart after the last one, so a
+    request never sees another one's half applied change.
+    """
+
+    def __init__(self, database: DatabaseCartStore):
+        self.database = database
+        self._carts: Dict[str, MemoryCart] = {}
+
+    def _memory_cart(self, user_id: Optional[UUID], session_token: Optional[str]) -> Optional[MemoryCart]:
+        if user_id or not session_token:
+            return None
+        return self._carts.get(session_token)
+
+    async def _in_database(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]) -> bool:
+        if user_id or not session_token:
+            return True
+        return await db.scalar(select(Cart.id).where(Cart.session_token == session_token)) is not None
+
+    async def get(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]) -> CartView:
+        cart = self._memory_cart(user_id, session_token)
+        if cart is None:
+            return await self.database.get(db, user_id, session_token)
+        cart.touched_at = time.monotonic()
+        return cart.view(session_token)
+
+    async def add(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                  product_id: UUID, quantity: int):
+        if self._memory_cart(user_id, session_token) is None:
+            if await self._in_database(db, user_id, session_token) or len(self._carts) >= config.cart_memory_max_carts:
+                return await self.database.add(db, user_id, session_token, product_id, quantity)
+        product = (await _products(db, [product_id]))[product_id]
+        cart = self._carts.setdefault(session_token, MemoryCart())
+        line = cart.lines.get(product_id)
+        if line is None:
+            line = cart.lines[product_id] = MemoryCartLine(id=uuid4(), product_id=product_id, quantity=0, price=0.0,
+                                                           title=product.title)
+        line.quantity += quantity
+        line.price = float(product.price) * line.quantity
+        line.title = product.title
+        cart.touch()
+
+    async def set_quantity(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                           item_id: UUID, quantity: int):
+        cart = self._memory_cart(user_id, session_token)
+        if cart is None:
+            return await self.database.set_quantity(db, user_id, session_token, item_id, quantity)
+        line = cart.line(item_id)
+        if line is None:
+            raise BadRequestError("Sepette bu ürüne ait öğe bulunamadı.")
+        product = (await _products(db, [line.product_id]))[line.product_id]
+        cart = self._memory_cart(user_id, session_token)
+        line = cart.line(item_id) if cart else None
+        if line is None:
+            raise BadRequestError("Sepette bu ürüne ait öğe bulunamadı.")
+        line.quantity = quantity
+        line.price = float(product.price) * quantity
+        cart.touch()
+
+    async def remove(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str], item_id: UUID):
+        cart = self._memory_cart(user_id, session_token)
+        if cart is None:
+            return await self.database.remove(db, user_id, session_token, item_id)
+        line = cart.line(item_id)
+        if line is None:
+            raise BadRequestError("Ürün bulunamadı.")
+        del cart.lines[line.product_id]
+        cart.touch()
+
+    async def clear(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str]):
+        if self._memory_cart(user_id, session_token) is None:
+            return await self.database.clear(db, user_id, session_token)
+        del self._carts[session_token]
+
+    async def apply(self, db: AsyncSession, user_id: Optional[UUID], session_token: Optional[str],
+                    operations: List[CartOperation]) -> CartView:
+        adds = any(operation.op == CartOperationType.ADD for operation in operations)
+        for _ in range(3):
+            cart = self._memory_cart(user_id, session_token)
+            if cart is None and (not adds or len(self._carts) >= config.cart_memory_max_carts
+                                 or await self._in_database(db, user_id, session_token)):
+                return await self.database.apply(db, user_id, session_token, operations)
+            version = cart.version if cart else None
+            lines = cart.lines if cart else {}
+            quantities = apply_operations({line.product_id: line.quantity for line in lines.values()},
+                                          {line.id: line.product_id for line in lines.values()}, operations)
+            products = await _products(db, [product_id for product_id, quantity in quantities.items()
+                                            if product_id not in lines or lines[product_id].quantity != quantity])
+            # the batch was folded on the cart as it was before the product read; fold again if it changed since
+            if self._carts.get(session_token) is not cart or (cart and cart.version != version):
+                continue
+            cart = cart or self._carts.setdefault(session_token, MemoryCart())
+            for product_id in [product_id for product_id in cart.lines if product_id not in quantities]:
+                del cart.lines[product_id]
+            for product_id, product in products.items():
+                line = cart.lines.get(product_id)
+                if line is None:
+                    line = cart.lines[product_id] = MemoryCartLine(id=uuid4(), product_id=product_id, quantity=0,
+                                                                   price=0.0, title=product.title)
+                line.quantity = quantities[product_id]
+                line.price = float(product.price) * line.quantity
+                line.title = product.title
+            cart.touch()
+            return cart.view(session_token)
+        raise BadRequestError("Sepet aynı anda güncelleniyor, lütfen tekrar deneyiniz.")
+
+    async def flush(self, db: AsyncSession, session_token: Optional[str]):
+        """Writes the memory cart of session_token into Postgres within db's transaction.
+
+        The memory copy is dropped once that commits, unless it changed in the meantime; it then
+        stays authoritative and the next flush writes it again, which is safe as a flush replaces
+        the stored lines.
+        """
+        cart = self._carts.get(session_token) if session_token else None
+        if cart is None:
+            return
+        version = cart.version
+        lines = [(line.id, line.product_id, line.quantity) for line in cart.lines.values()]
+        cart_id = await Cart.upsert(db, None, session_token, cart.id)
+        await CartItem.replace(db, cart_id, lines)
+        after_commit(db, partial(self._flushed, session_token, cart, version))
+
+    def _flushed(self, session_token: str, cart: MemoryCart, version: int):
+        if self._carts.get(session_token) is cart and cart.version == version:
+            del self._carts[session_token]
+
+    def sweep(self) -> List[str]:
+        """Drops carts idle for longer than cart_memory_ttl; returns the tokens of carts due for a flush."""
+        now = time.monotonic()
+        for session_token in [token for token, cart in self._carts.items()
+                              if now - cart.touched_at > config.cart_memory_ttl]:
+            del self._carts[session_token]
+        return [token for token, cart in self._carts.items() if now - cart.created_at > config.cart_flush_dwell_seconds]
+
+    def tokens(self) -> List[str]:
+        return list(self._carts)
+
+
+cart_store = MemoryCartStore(DatabaseCartStore()) if config.cart_store_backend == "memory" else DatabaseCartStore()
@@ -1,59 +1,119 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import select
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import ForeignKey, Index, any_, bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
 
 from src.category.schemas import CategoryCreate, CategoryUpdate
 
 from src.product.models import Product
 
-from src.utils.single_psql_db import Base, get_db
+from src.utils.single_psql_db import Base
 from src.utils.exceptions import BadRequestError
 
 
 class Category(Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        Index("ix_categories_updated_at_id", "updated_at", "id"),
+        Index("ix_categories_path", "path", postgresql_ops={"path": "varchar_pattern_ops"}),
+    )
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     name: Mapped[str] = mapped_column(nullable=False)
     description: Mapped[str] = mapped_column(nullable=False)
     is_active: Mapped[bool] = mapped_column(nullable=False, default=True)
+    parent_id: Mapped[Optional[UUID]] = mapped_column(ForeignKey("categories.id"), nullable=True, index=True)
+    # materialized path: ids from the root down to this category joined by "/", so a subtree is a prefix match
+    path: Mapped[str] = mapped_column(nullable=False)
+
+    # never loaded implicitly: listings use product_counts() and /category/{id}/products pages through products
+    products: Mapped[list[Product]] = relationship("Product", backref="category", lazy="raise", passive_deletes=True)
+
+    @classmethod
+    async def create(cls, db: AsyncSession, category: CategoryCreate):
+        instance = Category(id=uuid4(), **category.model_dump(exclude_none=True))
+        instance.path = await cls._child_path(db, instance.parent_id, instance.id)
+        db.add(instance)
+        await db.flush()
+        await db.refresh(instance)
+        return instance
+
+    @classmethod
+    async def update(cls, db: AsyncSession, id: UUID, data: CategoryUpdate):
+        stmt = select(cls).where(cls.id == id)
+        instance = await db.scalar(stmt)
+        if instance is None:
+            raise BadRequestError("Kategori bulunamadı.")
+        values = data.model_dump(exclude_unset=True)
+        parent_id = values.pop("parent_id", None)
+        for key, value in values.items():
+            setattr(instance, key, value)
+        if "parent_id" in data.model_fields_set and parent_id != instance.parent_id:
+            await cls._move(db, instance, parent_id)
+        await db.flush()
+        await db.refresh(instance)
+        return instance
 
-    products: Mapped[Product] = relationship("Product", backref="category", lazy="joined")
+    @classmethod
+    async def _child_path(cls, db: AsyncSession, parent_id: Optional[UUID], id: UUID) -> str:
+        if parent_id is None:
+            return str(id)
+        parent_path = await db.scalar(select(cls.path).where(cls.id == parent_id))
+        if parent_path is None:
+            raise BadRequestError("Üst kategori bulunamadı.")
+        if str(id) in parent_path.split("/"):
+            raise BadRequestError("Kategori kendisinin veya alt kategorisinin altına taşınamaz.")
+        return f"{parent_path}/{id}"
 
     @classmethod
-    async def create(cls, category: CategoryCreate):
-        async with get_db() as db:
-            instance = Category(**category.model_dump(exclude_none=True))
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-            return instance
+    async def _move(cls, db: AsyncSession, instance: "Category", parent_id: Optional[UUID]):
+        old_path = instance.path
+        new_path = await cls._child_path(db, parent_id, instance.id)
+        # rewrite the prefix of every descendant in one statement
+        await db.execute(
+            update(cls)
+            .where(cls.path.startswith(old_path + "/"))
+            .values(path=func.concat(new_path, func.substr(cls.path, len(old_path) + 1)))
+        )
+        instance.parent_id = parent_id
+        instance.path = new_path
 
     @classmethod
-    async def update(cls, id: UUID, data: CategoryUpdate):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == id)
-            instance = await db.scalar(stmt)
-            if instance is None:
-                raise BadRequestError("Kategori bulunamadı.")
-            for key, value in data.dict().items():
-                setattr(instance, key, value)
-            await db.commit()
-            await db.refresh(instance)
-            return instance
+    async def has_children(cls, db: AsyncSession, id: UUID) -> bool:
+        return await db.scalar(select(select(cls.id).where(cls.parent_id == id).exists()))
 
     @classmethod
-    async def delete(cls, id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == id)
-            instance = await db.scalar(stmt)
-            if instance is None:
-                raise BadRequestError("Kategori bulunamadı.")
-            await db.delete(instance)
-            await db.commit()
+    async def delete(cls, db: AsyncSession, id: UUID):
+        stmt = select(cls).where(cls.id == id)
+        instance = await db.scalar(stmt)
+        if instance is None:
+            raise BadRequestError("Kategori bulunamadı.")
+        await db.delete(instance)
+        await db.flush()
 
     @classmethod
-    async def get(cls, category_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == category_id)
-            return await db.scalar(stmt)
+    async def get_version(cls, db: AsyncSession, category_id: UUID) -> Optional[datetime]:
+        return await db.scalar(select(cls.updated_at).where(cls.id == category_id))
 
+    @classmethod
+    async def get(cls, db: AsyncSession, category_id: UUID):
+        stmt = select(cls).where(cls.id == category_id)
+        return await db.scalar(stmt)
+
+    @classmethod
+    async def product_counts(cls, db: AsyncSession, category_ids: list[UUID]) -> dict[UUID, int]:
+        # one grouped aggregate for a whole page of categories, served from ix_products_category_id_updated_at
+        counts = {category_id: 0 for category_id in category_ids}
+        if not category_ids:
+            return counts
+        stmt = (
+            select(Product.category_id, func.count())
+            .where(Product.category_id == any_(bindparam("category_ids", list(category_ids), type_=ARRAY(PG_UUID))))
+            .group_by(Product.category_id)
+        )
+        for category_id, count in await db.execute(stmt):
+            counts[category_id] = count
+        return counts
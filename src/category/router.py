@@ -1,13 +1,17 @@
 from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import JSONResponse
 
 from src.auth.current_user import get_current_user
-from src.category.schemas import CategoryCreate
+from src.category.schemas import CategoryCreate, CategoryUpdate
 from src.category.service import CategoryService
+from src.product.schemas import ProductFilterGet
 from src.users.models import User
+from src.utils.conditional import etag_headers, not_modified
 from src.utils.schemas import PaginationGet
+from src.utils.single_psql_db import get_session
 
 category = APIRouter(
     prefix="/category",
@@ -17,30 +21,49 @@ category = APIRouter(
 
 
 @category.post("")
-async def create_category(category: CategoryCreate, current_user: User = Depends(get_current_user)):
-    resp = await CategoryService.create(category=category, actor=current_user)
+async def create_category(category: CategoryCreate, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    resp = await CategoryService.create(db, category=category, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @category.get("")
-async def get_categories(data: PaginationGet = Depends()):
-    content = await CategoryService.get(pagination_data=data)
+async def get_categories(data: PaginationGet = Depends(), db: AsyncSession = Depends(get_session)):
+    content = await CategoryService.get(db, pagination_data=data)
+    return JSONResponse(status_code=content.status, content=content.model_dump())
+
+
+@category.get("/tree")
+async def get_category_tree(db: AsyncSession = Depends(get_session)):
+    content = await CategoryService.get_tree(db)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @category.get("/{category_id}")
-async def get_category(category_id: UUID):
-    content = await CategoryService.get_category(category_id=category_id)
+async def get_category(category_id: UUID, request: Request, db: AsyncSession = Depends(get_session)):
+    etag = await CategoryService.get_category_etag(db, category_id=category_id)
+    if response := not_modified(request, etag):
+        return response
+    content = await CategoryService.get_category(db, category_id=category_id)
+    return JSONResponse(status_code=content.status, content=content.model_dump(), headers=etag_headers(etag))
+
+
+@category.get("/{category_id}/products")
+async def get_category_products(category_id: UUID, data: ProductFilterGet = Depends(),
+                                db: AsyncSession = Depends(get_session)):
+    content = await CategoryService.get_category_products(db, category_id=category_id, pagination_data=data)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @category.put("/{category_id}")
-async def update_category(category_id: UUID, data: CategoryCreate, current_user: User = Depends(get_current_user)):
-    content = await CategoryService.update(category_id=category_id, data=data, actor=current_user)
+async def update_category(category_id: UUID, data: CategoryUpdate, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    content = await CategoryService.update(db, category_id=category_id, data=data, actor=current_user)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @category.delete("/{category_id}")
-async def delete_category(category_id: UUID, current_user: User = Depends(get_current_user)):
-    content = await CategoryService.delete(category_id=category_id, actor=current_user)
+async def delete_category(category_id: UUID, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    content = await CategoryService.delete(db, category_id=category_id, actor=current_user)
     return JSONResponse(status_code=content.status, content=content.model_dump())
\ No newline at end of file
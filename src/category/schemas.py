@@ -10,6 +10,7 @@ class CategoryCreate(BaseModel):
     name: str
     description: Optional[str]
     is_active: Optional[bool] = True
+    parent_id: Optional[UUID] = None
 
     class Config:
         orm_mode = True
@@ -21,6 +22,8 @@ class CategoryView(BaseModel, UUIDView):
     id: UUID
     name: str
     description: str
+    parent_id: Optional[UUID] = None
+    product_count: int = 0
 
     class Config:
         orm_mode = True
@@ -29,9 +32,11 @@ class CategoryView(BaseModel, UUIDView):
 
 
 class CategoryUpdate(BaseModel):
-    name: Optional[str]
-    description: Optional[str]
-    is_active: Optional[bool]
+    # partial: only the fields sent are changed, so leaving parent_id out keeps the category where it is
+    name: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+    parent_id: Optional[UUID] = None
 
     class Config:
         orm_mode = True
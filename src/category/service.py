@@ -1,39 +1,56 @@
 from src.auth.access.service import need_role
 from src.category.models import Category
-from src.category.schemas import CategoryCreate, CategoryView
+from src.category.schemas import CategoryCreate, CategoryUpdate, CategoryView
+from src.category.tree import category_tree, invalidate_tree
+from src.product.cache import invalidate_all
 from src.product.models import Product
+from src.product.schemas import ProductFilterGet
+from src.product.service import ProductService
 from src.users.models import User
 from src.users.schemas import UserRole
 
-from src.utils.single_psql_db import get_db
-from src.utils.pagination import get_pagination_info
+from src.utils.pagination import get_pagination_info, get_cursor_pagination_info, apply_keyset, split_keyset_page
 from src.utils.exceptions import NotFoundError, BadRequestError
 from src.utils.schemas import GeneralResponse, PaginationGet, ListView
+from src.utils.conditional import version_etag
+from src.utils.single_psql_db import read_only
 
 
 from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from uuid import UUID
 
 
+def _category_view(category: Category, product_count: int) -> CategoryView:
+    view = CategoryView.model_validate(category)
+    view.product_count = product_count
+    return view
+
+
 class CategoryService:
     @staticmethod
-    async def create(category: CategoryCreate, actor: User):
+    async def create(db: AsyncSession, category: CategoryCreate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        await Category.create(category)
+        await Category.create(db, category)
+        invalidate_tree(db)
         return GeneralResponse(status=201, message="Kategori Başarıyla Oluşturuldu")
 
     @staticmethod
-    async def get(pagination_data: PaginationGet):
-        async with get_db() as db:
-            where_query = None
-            if pagination_data.search:
-                where_query = (
-                    (Category.name.like(f"%{pagination_data.search}%"))
-                )
-            if where_query is not None:
-                query = select(Category).where(where_query)
-            else:
-                query = select(Category)
+    @read_only
+    async def get(db: AsyncSession, pagination_data: PaginationGet):
+        where_query = None
+        if pagination_data.search:
+            where_query = (
+                (Category.name.like(f"%{pagination_data.search}%"))
+            )
+        if where_query is not None:
+            query = select(Category).where(where_query)
+        else:
+            query = select(Category)
+        if pagination_data.keyset:
+            query = apply_keyset(query, Category, pagination_data)
+        else:
             if pagination_data.paginate:
                 query = query.limit(pagination_data.pageSize).offset(
                     (pagination_data.page - 1) * pagination_data.pageSize
@@ -41,58 +58,96 @@ class CategoryService:
             if pagination_data.order:
                 query = query.order_by(Category.updated_at.desc())
 
-            category = await db.scalars(query)
-            category = category.all()
+        category = await db.scalars(query)
+        category = category.all()
+        next_cursor = None
+        if pagination_data.keyset:
+            category, next_cursor = split_keyset_page(category, pagination_data)
 
-            count = await Category.get_count(where_query)
+        counts = await Category.product_counts(db, [item.id for item in category])
+        items = [_category_view(item, counts[item.id]) for item in category]
+
+        count, exact = await Category.get_total(db, where_query)
+        if pagination_data.keyset:
+            pagination_info = get_cursor_pagination_info(count, pagination_data, len(category), next_cursor, exact)
+        else:
             pagination_info = get_pagination_info(total_items=count, current_page=pagination_data.page,
-                                                  page_size=pagination_data.pageSize)
+                                                  page_size=pagination_data.pageSize, exact=exact)
 
-            return GeneralResponse(
-                status=200,
-                message="Ürünler Listelendi.",
-                details=ListView[CategoryView](info=pagination_info, items=category)
-            )
+        return GeneralResponse(
+            status=200,
+            message="Ürünler Listelendi.",
+            details=ListView[CategoryView](info=pagination_info, items=items)
+        )
 
     @staticmethod
-    async def get_category(category_id: UUID):
-        async with get_db() as db:
-            category = await Category.get(category_id)
-            if not category:
-                raise NotFoundError("Kategori Bulunamadı")
-            return GeneralResponse(status=200, message="Kategori Bulundu", details=CategoryView.model_validate(category))
+    @read_only
+    async def get_tree(db: AsyncSession):
+        tree = await category_tree.snapshot(db)
+        return GeneralResponse(status=200, message="Kategori Ağacı", details=tree.render())
 
     @staticmethod
-    async def update(category_id: UUID, data: CategoryCreate, actor: User):
+    @read_only
+    async def get_category_etag(db: AsyncSession, category_id: UUID) -> Optional[str]:
+        updated_at = await Category.get_version(db, category_id)
+        if updated_at is None:
+            return None
+        # the body carries product_count, which changes without touching the category row
+        node = (await category_tree.snapshot(db)).get(category_id)
+        return version_etag(category_id, updated_at, node.product_count if node else 0)
+
+    @staticmethod
+    @read_only
+    async def get_category(db: AsyncSession, category_id: UUID):
+        category = await Category.get(db, category_id)
+        if not category:
+            raise NotFoundError("Kategori Bulunamadı")
+        # same count the ETag is built from, so a 304 never hides a changed body
+        node = (await category_tree.snapshot(db)).get(category.id)
+        return GeneralResponse(status=200, message="Kategori Bulundu",
+                               details=_category_view(category, node.product_count if node else 0))
+
+    @staticmethod
+    @read_only
+    async def get_category_products(db: AsyncSession, category_id: UUID, pagination_data: ProductFilterGet):
+        if not await Category.get(db, category_id):
+            raise NotFoundError("Kategori Bulunamadı")
+        return await ProductService.get_products(db, pagination_data, category_id=category_id)
+
+    @staticmethod
+    async def update(db: AsyncSession, category_id: UUID, data: CategoryUpdate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        async with get_db() as db:
-            category = await Category.get(category_id)
-            if not category:
-                raise NotFoundError("Kategori Bulunamadı")
-            await category.update(id=category_id, data=data)
-            return GeneralResponse(status=200, message="Kategori Güncellendi")
+        category = await Category.get(db, category_id)
+        if not category:
+            raise NotFoundError("Kategori Bulunamadı")
+        await category.update(db, id=category_id, data=data)
+        invalidate_tree(db)
+        invalidate_all(db)
+        return GeneralResponse(status=200, message="Kategori Güncellendi")
 
     @staticmethod
-    async def delete(category_id: UUID, actor: User):
+    async def delete(db: AsyncSession, category_id: UUID, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        async with get_db() as db:
-            stmt = select(Category).where(Category.id == category_id)
-            category = await db.scalar(stmt)
+        stmt = select(Category).where(Category.id == category_id)
+        category = await db.scalar(stmt)
 
-            if category is None:
-                raise BadRequestError("Kategori bulunamadı.")
+        if category is None:
+            raise BadRequestError("Kategori bulunamadı.")
 
-            product_count_stmt = select(func.count()).select_from(Product).where(Product.category_id == category_id)
-            product_count = await db.scalar(product_count_stmt)
+        product_count_stmt = select(func.count()).select_from(Product).where(Product.category_id == category_id)
+        product_count = await db.scalar(product_count_stmt)
 
-            if product_count > 0:
-                raise BadRequestError(f"Bu kategori silinemez çünkü {product_count} ürün ile ilişkilidir.")
+        if product_count > 0:
+            raise BadRequestError(f"Bu kategori silinemez çünkü {product_count} ürün ile ilişkilidir.")
+        if await Category.has_children(db, category_id):
+            raise BadRequestError("Bu kategori silinemez çünkü alt kategorileri var.")
 
-            await db.delete(category)
-            await db.commit()
+        await db.delete(category)
+        await db.flush()
+        invalidate_tree(db)
 
-            return GeneralResponse(
-                status=200,
-                message="Kategori başarıyla silindi.",
-                details=CategoryView.model_validate(category)
-            )
+        return GeneralResponse(
+            status=200,
+            message="Kategori başarıyla silindi.",
+            details=CategoryView.model_validate(category)
+        )
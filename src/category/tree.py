@@ -0,0 +1,143 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.category.models import Category
+from src.product.models import Product
+from src.settings import config
+from src.utils.single_psql_db import after_commit
+
+
+@dataclass
+class CategoryNode:
+    id: UUID
+    name: str
+    parent_id: Optional[UUID]
+    product_count: int = 0
+    subtree_product_count: int = 0
+    children: List["CategoryNode"] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "name": self.name,
+            "parent_id": str(self.parent_id) if self.parent_id else None,
+            "product_count": self.product_count,
+            "subtree_product_count": self.subtree_product_count,
+            "children": [child.as_dict() for child in self.children],
+        }
+
+
+class CategoryTree:
+    """Per-worker snapshot of the category hierarchy with direct and subtree product counts.
+
+    Built with two queries and then kept current in memory: product writes adjust the counts along
+    the ancestor chain after commit, category writes mark the snapshot stale. It is rebuilt when stale
+    or older than category_tree_ttl, which also picks up writes made by other workers.
+    """
+
+    def __init__(self):
+        self._nodes: Dict[UUID, CategoryNode] = {}
+        self._roots: List[CategoryNode] = []
+        self._built_at: Optional[float] = None
+        self._rendered: Optional[list] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return self._built_at is not None and time.monotonic() - self._built_at < config.category_tree_ttl
+
+    async def snapshot(self, db: AsyncSession) -> "CategoryTree":
+        if not self.fresh:
+            async with self._lock:
+                if not self.fresh:
+                    await self._build(db)
+        return self
+
+    async def _build(self, db: AsyncSession):
+        rows = await db.execute(select(Category.id, Category.name, Category.parent_id).order_by(Category.name))
+        nodes = {row.id: CategoryNode(id=row.id, name=row.name, parent_id=row.parent_id) for row in rows}
+        counts = await db.execute(select(Product.category_id, func.count()).group_by(Product.category_id))
+        for category_id, count in counts:
+            if category_id in nodes:
+                nodes[category_id].product_count = count
+
+        roots = []
+        for node in nodes.values():
+            parent = nodes.get(node.parent_id)
+            (parent.children if parent else roots).append(node)
+        for root in roots:
+            _sum_subtree(root)
+
+        self._nodes, self._roots, self._rendered = nodes, roots, None
+        self._built_at = time.monotonic()
+
+    def get(self, category_id: UUID) -> Optional[CategoryNode]:
+        return self._nodes.get(category_id)
+
+    def subtree_ids(self, category_id: UUID) -> List[UUID]:
+        node = self._nodes.get(category_id)
+        if node is None:
+            return [category_id]
+        ids, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            ids.append(node.id)
+            stack.extend(node.children)
+        return ids
+
+    def render(self) -> list:
+        if self._rendered is None:
+            self._rendered = [root.as_dict() for root in self._roots]
+        return self._rendered
+
+    def invalidate(self):
+        self._built_at = None
+
+    def adjust(self, category_id: UUID, delta: int):
+        if self._built_at is None:
+            return
+        node = self._nodes.get(category_id)
+        if node is None:
+            # a category this snapshot has not seen yet
+            self.invalidate()
+            return
+        node.product_count += delta
+        while node is not None:
+            node.subtree_product_count += delta
+            node = self._nodes.get(node.parent_id)
+        self._rendered = None
+
+
+def _sum_subtree(root: CategoryNode):
+    # iterative post-order, so deep trees cannot hit the recursion limit
+    stack, order = [root], []
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(node.children)
+    for node in reversed(order):
+        node.subtree_product_count = node.product_count + sum(child.subtree_product_count for child in node.children)
+
+
+category_tree = CategoryTree()
+
+
+def product_moved(db: AsyncSession, old_category_id: Optional[UUID], new_category_id: Optional[UUID]):
+    """Moves one product between categories in the snapshot once the transaction commits; None means created/deleted."""
+    if old_category_id == new_category_id:
+        return
+    if old_category_id is not None:
+        after_commit(db, partial(category_tree.adjust, old_category_id, -1))
+    if new_category_id is not None:
+        after_commit(db, partial(category_tree.adjust, new_category_id, 1))
+
+
+def invalidate_tree(db: AsyncSession):
+    after_commit(db, category_tree.invalidate)
@@ -19,6 +19,9 @@ class Complaint(Document):
     created_at: datetime = Field(default_factory=datetime_utc_now)
     updated_at: datetime = Field(default_factory=datetime_utc_now)
 
+    class Settings:
+        indexes = [[("created_at", -1), ("_id", -1)]]
+
     @before_event([Replace, Insert])
     def update_update_at(self):
         self.updated_at = datetime.now(UTC)
@@ -1,4 +1,4 @@
-from src.utils.pagination import get_pagination_info
+from src.utils.pagination import get_pagination_info, get_cursor_pagination_info, decode_cursor, split_keyset_page
 from src.utils.exceptions import *
 from src.utils.schemas import GeneralResponse, PaginationGet, ListView
 from src.auth.access.service import need_role
@@ -8,6 +8,7 @@ from typing import Optional
 from uuid import UUID
 
 from bson import ObjectId
+from bson.errors import InvalidId
 
 from src.complaint.models import Complaint
 from src.complaint.schemas import ComplaintCreate, ComplaintView, ComplaintStatus
@@ -28,17 +29,30 @@ class ComplaintService:
         stmt = Complaint.find()
         if author_id is not None:
             stmt = stmt.find(user_id=author_id)
-        if pagination.order:
+        if pagination.order and not pagination.keyset:
             stmt = stmt.sort("-created_at")
         if pagination.search:
             stmt = stmt.find({"$text": {"$search": pagination.search}})
         count = await stmt.count()
-        if pagination.paginate:
+        if pagination.keyset:
+            if pagination.after:
+                at, key = decode_cursor(pagination.after)
+                try:
+                    key = ObjectId(key)
+                except InvalidId:
+                    raise BadRequestError("Geçersiz sayfa imleci.")
+                stmt = stmt.find({"$or": [{"created_at": {"$lt": at}}, {"created_at": at, "_id": {"$lt": key}}]})
+            stmt = stmt.sort([("created_at", -1), ("_id", -1)]).limit(pagination.pageSize + 1)
+        elif pagination.paginate:
             stmt = stmt.skip((pagination.page - 1) * pagination.pageSize).limit(pagination.pageSize)
 
         complaints = await stmt.to_list()
-        pagination_info = get_pagination_info(total_items=count, current_page=pagination.page,
-                                              page_size=pagination.pageSize)
+        if pagination.keyset:
+            complaints, next_cursor = split_keyset_page(complaints, pagination, at_field="created_at")
+            pagination_info = get_cursor_pagination_info(count, pagination, len(complaints), next_cursor)
+        else:
+            pagination_info = get_pagination_info(total_items=count, current_page=pagination.page,
+                                                  page_size=pagination.pageSize)
         return GeneralResponse(status=200, message="Şikayetler getirildi",
                                details=ListView[ComplaintView](items=complaints,
                                                                info=pagination_info)
@@ -1,24 +1,35 @@
+import asyncio
 from datetime import datetime, timedelta
 from pathlib import Path
+from uuid import uuid4
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from jose import jwt
 from starlette import status
 
 from src.settings import config
-from src.utils.single_psql_db import init_psql_db
+from src.utils.single_psql_db import init_psql_db, close_psql_db, pool_status
 from src.utils.single_mongo_db import init_mongo_db
+from src.utils.images import shutdown_image_pool
+from src.utils.media import MediaFiles
 from src.utils.exceptions import GeneralException
+from src.utils.schemas import GeneralResponse
+
+from src.auth.access.service import need_role
+from src.auth.current_user import get_current_user
 
 from src.users.router import user
 from src.product.router import product
+from src.product.service import ProductService
 from src.category.router import category
 from src.auth.base.router import auth
 from src.cart.router import cart
+from src.cart.service import CartService
 from src.order.router import order
+from src.users.models import User
+from src.users.schemas import UserRole
 
 app = FastAPI(
     title="E-Commerce API",
@@ -48,7 +59,8 @@ app.add_middleware(
 )
 
 UPLOAD_DIR = Path("uploads")
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", MediaFiles(directory=UPLOAD_DIR, offload=config.media_offload,
+                                 offload_prefix=config.media_offload_prefix), name="uploads")
 
 
 def create_access_token(data: dict,
@@ -64,8 +76,10 @@ def create_access_token(data: dict,
 async def add_session_token(request: Request, call_next):
     if "session_token" not in request.cookies:
         access_token_expires = timedelta(minutes=config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
+        # the token keys the visitor's cart, addresses and orders, so two visitors arriving in the same second
+        # must not get the same one
         access_token = create_access_token(
-            data={"sub": "user"}, expires_delta=access_token_expires
+            data={"sub": "user", "jti": uuid4().hex}, expires_delta=access_token_expires
         )
 
         response = await call_next(request)
@@ -97,10 +111,38 @@ async def get_profile(request: Request):
     user_data = verify_token(token)
     return {"user": user_data["sub"]}
 
+@app.get("/db/pool")
+async def get_pool_status(current_user: User = Depends(get_current_user)):
+    need_role(current_user, [UserRole.ADMIN])
+    resp = GeneralResponse(status=200, message="Bağlantı havuzu durumu", details=pool_status())
+    return JSONResponse(status_code=resp.status, content=resp.model_dump())
+
+
 @app.on_event("startup")
 async def startup():
     await init_psql_db()
     await init_mongo_db()
+    if config.product_search_backend == "memory":
+        since = await ProductService.build_search_index()
+        app.state.search_index_sync = asyncio.create_task(ProductService.sync_search_index(since))
+    if config.stock_rebalance_seconds > 0:
+        app.state.stock_rebalancer = asyncio.create_task(ProductService.rebalance_stock_shards())
+    if config.cart_store_backend == "memory":
+        app.state.cart_sweeper = asyncio.create_task(CartService.sweep_carts())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if getattr(app.state, "search_index_sync", None):
+        app.state.search_index_sync.cancel()
+    if getattr(app.state, "stock_rebalancer", None):
+        app.state.stock_rebalancer.cancel()
+    if getattr(app.state, "cart_sweeper", None):
+        app.state.cart_sweeper.cancel()
+        # anonymous carts still in memory would not survive the restart
+        await CartService.flush_all_carts()
+    shutdown_image_pool()
+    await close_psql_db()
 
 
 @app.exception_handler(GeneralException)
@@ -1,11 +1,12 @@
 from typing import List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import ForeignKey, Enum
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
 
 from src.order.schemas import OrderStatus
 from src.product.models import Product
-from src.utils.single_psql_db import Base, get_db
+from src.utils.single_psql_db import Base
 
 
 class Order(Base):
@@ -13,7 +14,7 @@ class Order(Base):
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"), nullable=True)
-    session_token: Mapped[str] = mapped_column(nullable=True)
+    session_token: Mapped[str] = mapped_column(nullable=True, index=True)
     order_number: Mapped[str] = mapped_column(nullable=False)
     address_id: Mapped[UUID] = mapped_column(ForeignKey("addresses.id"), nullable=False)
     total_amount: Mapped[float] = mapped_column(nullable=False)
@@ -24,13 +25,12 @@ class Order(Base):
     items: Mapped[list["OrderItem"]] = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
     @classmethod
-    async def create(cls, order_data: dict):
-        async with get_db() as db:
-            instance = cls(**order_data)
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-            return instance
+    async def create(cls, db: AsyncSession, order_data: dict):
+        instance = cls(**order_data)
+        db.add(instance)
+        await db.flush()
+        await db.refresh(instance)
+        return instance
 
 
 class OrderItem(Base):
@@ -2,6 +2,7 @@ from typing import Optional
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException, status, Depends, Header, Request, Cookie
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import JSONResponse
 
 from src.auth.current_user import get_current_user
@@ -9,6 +10,7 @@ from src.order.service import OrderService
 from src.users.models import User
 from src.utils.exceptions import BadRequestError
 from src.utils.schemas import PaginationGet
+from src.utils.single_psql_db import get_session
 
 order = APIRouter(
     prefix="/order",
@@ -18,7 +20,8 @@ order = APIRouter(
 
 
 @order.post("")
-async def create_order(request: Request, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
+async def create_order(request: Request, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                       db: AsyncSession = Depends(get_session)):
     if current_user is None:
         try:
             current_user = await get_current_user(request=request)
@@ -28,13 +31,13 @@ async def create_order(request: Request, current_user: Optional[User] = Depends(
     if not current_user and not session_token:
         raise BadRequestError("Kullanıcı bilgisi bulunamadı !")
 
-    resp = await OrderService.create_order(current_user, session_token)
+    resp = await OrderService.create_order(db, current_user, session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @order.get("")
-async def get_orders(current_user: Optional[User] = Depends(get_current_user)):
-    resp = await OrderService.get_orders(current_user)
+async def get_orders(current_user: Optional[User] = Depends(get_current_user), db: AsyncSession = Depends(get_session)):
+    resp = await OrderService.get_orders(db, current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
@@ -0,0 +1,65 @@
+from functools import partial
+from typing import Hashable, Iterable, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.settings import config
+from src.utils.cache import BytesLRUCache
+from src.utils.inverted_index import tokenize
+from src.product.schemas import ProductFilterGet
+from src.utils.single_psql_db import after_commit
+
+# serialized GET /product bodies, tagged with "product:<id>" for every item on the page plus
+# "browse" (no search) or "search:<term>"
+listing_cache = BytesLRUCache(ttl=config.product_list_cache_ttl, max_bytes=config.product_list_cache_bytes)
+
+
+def listing_key(pagination_data: ProductFilterGet) -> Hashable:
+    search = pagination_data.search or None
+    page = None if pagination_data.keyset or not pagination_data.paginate else pagination_data.page
+    page_size = pagination_data.pageSize if pagination_data.paginate or pagination_data.keyset else None
+    return (page, page_size, search, bool(pagination_data.order), pagination_data.keyset, pagination_data.after,
+            *pagination_data.filter_key)
+
+
+def listing_tags(pagination_data: ProductFilterGet, items: Iterable) -> list:
+    search = pagination_data.search
+    tags = [f"search:{search}" if search else "browse"]
+    tags.extend(f"product:{item.id}" for item in items)
+    return tags
+
+
+def _matches(term: str, title: Optional[str], description: Optional[str]) -> bool:
+    # covers both backends: a substring of the title (database) or a shared token (memory index)
+    if term in (title or ""):
+        return True
+    return not set(tokenize(term)).isdisjoint(tokenize(title) + tokenize(description))
+
+
+def _invalidate(product_id: UUID, texts: Tuple[Tuple[Optional[str], Optional[str]], ...], reorder: bool):
+    tags = [f"product:{product_id}"]
+    if reorder:
+        tags.append("browse")
+    for tag in listing_cache.tags("search:"):
+        term = tag[len("search:"):]
+        if any(_matches(term, title, description) for title, description in texts):
+            tags.append(tag)
+    listing_cache.invalidate(*tags)
+
+
+def invalidate_product(db: AsyncSession, product_id: UUID, *texts: Tuple[Optional[str], Optional[str]],
+                       reorder: bool = True):
+    """Drops cached listings affected by a write to product_id once the transaction commits.
+
+    texts are the (title, description) pairs the product had before and after the write; searches
+    matching any of them are dropped. reorder also drops every browse page, for writes that bump
+    updated_at (shifting the default ordering) or move the product in or out of stock (shifting
+    in_stock filters, facet counts and totals).
+    """
+    after_commit(db, partial(_invalidate, product_id, texts, reorder))
+
+
+def invalidate_all(db: AsyncSession):
+    # bulk writes touch too many pages to track one by one
+    after_commit(db, listing_cache.clear)
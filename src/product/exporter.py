@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select
+
+from src.product.importer import COLUMNS
+from src.product.models import Product
+from src.settings import config
+from src.utils.single_psql_db import get_db
+
+EXPORT_COLUMNS = (*COLUMNS, "created_at", "updated_at")
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _row(row) -> tuple:
+    return (str(row.id), row.title, row.description, row.price, row.stock, row.is_active, str(row.category_id),
+            int(row.created_at.timestamp() * 1000), int(row.updated_at.timestamp() * 1000))
+
+
+def _csv_batch(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(_row(row) for row in rows)
+    return buffer.getvalue().encode()
+
+
+def _ndjson_batch(rows) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, _row(row))), ensure_ascii=False) + "\n" for row in rows
+    ).encode()
+
+
+async def export_products(fmt: str, batch_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yields the catalog as csv or ndjson, one chunk per batch_size rows.
+
+    Rows come from a server side cursor over plain columns, so only one batch is in memory at a time.
+    The generator opens its own session: the request session is closed before a streaming body is sent.
+    """
+    batch_size = batch_size or config.product_export_batch_size
+    query = (
+        select(*(getattr(Product, name) for name in EXPORT_COLUMNS))
+        .order_by(Product.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if fmt == "csv":
+        yield _csv_batch((), header=True)
+    async with get_db() as db:
+        db.info["read_only"] = True
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            yield _csv_batch(rows) if fmt == "csv" else _ndjson_batch(rows)
@@ -0,0 +1,81 @@
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import Float, and_, any_, bindparam, func, select, true, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+from src.product.models import Product
+from src.product.schemas import ProductFilterGet
+from src.settings import config
+
+# grouping() bitmask per grouping set: a set bit means the column is rolled up in that row
+_BY_CATEGORY, _BY_PRICE, _BY_STOCK, _TOTAL = 0b011, 0b101, 0b110, 0b111
+
+
+def filter_clauses(params: ProductFilterGet, category_ids: Optional[List[UUID]]) -> Dict[str, ColumnElement]:
+    """Facetable filters by facet name; each facet's counts are computed without its own filter."""
+    clauses = {}
+    if category_ids is not None:
+        clauses["category"] = Product.category_id == any_(bindparam(None, category_ids, type_=ARRAY(PG_UUID)))
+    price = []
+    if params.min_price is not None:
+        price.append(Product.price >= params.min_price)
+    if params.max_price is not None:
+        price.append(Product.price <= params.max_price)
+    if price:
+        clauses["price"] = and_(*price)
+    if params.in_stock is not None:
+        clauses["stock"] = Product.stock > 0 if params.in_stock else Product.stock <= 0
+    return clauses
+
+
+def _all(clauses: Dict[str, ColumnElement], *names: str) -> ColumnElement:
+    return and_(true(), *(clauses[name] for name in names if name in clauses))
+
+
+def _price_ranges() -> List[Tuple[float, Optional[float]]]:
+    edges = config.product_price_buckets
+    return [(edges[i], edges[i + 1] if i + 1 < len(edges) else None) for i in range(len(edges))]
+
+
+async def compute_facets(db: AsyncSession, base_query: Optional[ColumnElement],
+                         clauses: Dict[str, ColumnElement]) -> Tuple[dict, int]:
+    """Category, price bucket and in-stock counts plus the filtered total, in one aggregate pass.
+
+    GROUPING SETS produce one row group per facet; FILTER lets every facet ignore its own selection,
+    so shoppers still see the counts of the alternatives they could switch to.
+    """
+    bucket = func.width_bucket(Product.price, bindparam(None, config.product_price_buckets, type_=ARRAY(Float)))
+    in_stock = Product.stock > 0
+    stmt = (
+        select(
+            Product.category_id, bucket.label("bucket"), in_stock.label("in_stock"),
+            func.grouping(Product.category_id, bucket, in_stock).label("grouping"),
+            func.count().filter(_all(clauses, "price", "stock")).label("by_category"),
+            func.count().filter(_all(clauses, "category", "stock")).label("by_price"),
+            func.count().filter(_all(clauses, "category", "price")).label("by_stock"),
+            func.count().filter(_all(clauses, "category", "price", "stock")).label("total"),
+        )
+        .group_by(func.grouping_sets(tuple_(Product.category_id), tuple_(bucket), tuple_(in_stock), tuple_()))
+    )
+    if base_query is not None:
+        stmt = stmt.where(base_query)
+
+    ranges = _price_ranges()
+    facets = {"categories": [], "price": [], "in_stock": {"true": 0, "false": 0}}
+    total = 0
+    for row in await db.execute(stmt):
+        if row.grouping == _BY_CATEGORY and row.by_category:
+            facets["categories"].append({"id": str(row.category_id), "count": row.by_category})
+        elif row.grouping == _BY_PRICE and row.by_price and row.bucket:
+            low, high = ranges[row.bucket - 1]
+            facets["price"].append({"min": low, "max": high, "count": row.by_price})
+        elif row.grouping == _BY_STOCK and row.by_stock:
+            facets["in_stock"]["true" if row.in_stock else "false"] = row.by_stock
+        elif row.grouping == _TOTAL:
+            total = row.total
+    facets["categories"].sort(key=lambda item: -item["count"])
+    facets["price"].sort(key=lambda item: item["min"])
+    return facets, total
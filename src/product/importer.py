@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+from functools import partial
+from typing import IO, Iterator, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import Boolean, Column, Float, Integer, MetaData, String, Table, func, select, true
+from sqlalchemy.dialects.postgresql import insert, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.schema import CreateTable
+
+from src.category.models import Category
+from src.category.tree import invalidate_tree
+from src.product.cache import invalidate_all
+from src.product.models import Product, product_index
+from src.product.schemas import ProductImport, ProductImportReport
+from src.product.stock import spread_stock
+from src.settings import config
+from src.utils.exceptions import BadRequestError
+from src.utils.single_psql_db import after_commit, get_db
+
+FORMATS = ("csv", "ndjson")
+COLUMNS = ("id", "title", "description", "price", "stock", "is_active", "category_id")
+
+# rows are COPY'd here first, then upserted into products in one statement; the table lives per connection
+# and is emptied on every commit
+staging = Table(
+    "product_import_staging", MetaData(),
+    Column("id", PG_UUID(as_uuid=True)),
+    Column("title", String),
+    Column("description", String),
+    Column("price", Float),
+    Column("stock", Integer),
+    Column("is_active", Boolean),
+    Column("category_id", PG_UUID(as_uuid=True)),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DELETE ROWS",
+)
+
+Chunk = Tuple[List[Tuple[int, tuple]], List[dict], int]
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    raise BadRequestError("Desteklenmeyen dosya biçimi, csv veya ndjson yükleyiniz.")
+
+
+def _read_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    if fmt == "csv":
+        for line, record in enumerate(csv.DictReader(stream), start=1):
+            # empty csv cells mean "not given", e.g. a blank id column
+            yield line, {key: value for key, value in record.items() if value not in ("", None)}, None
+        return
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            yield line, None, "Geçersiz JSON satırı."
+            continue
+        if not isinstance(record, dict):
+            yield line, None, "Satır bir JSON nesnesi olmalı."
+            continue
+        yield line, record, None
+
+
+def _parse_chunks(stream: IO[str], fmt: str, chunk_size: int) -> Iterator[Chunk]:
+    """Yields (rows, errors, count) per chunk_size input rows; rows are (line, record tuple in COLUMNS order)."""
+    rows, errors, count = [], [], 0
+    for line, record, error in _read_records(stream, fmt):
+        count += 1
+        if error is None:
+            try:
+                product = ProductImport.model_validate(record)
+                rows.append((line, (product.id or uuid4(), product.title, product.description, product.price,
+                                    product.stock, product.is_active, product.category_id)))
+            except ValidationError as exc:
+                error = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+        if error is not None:
+            errors.append({"row": line, "error": error})
+        if count == chunk_size:
+            yield rows, errors, count
+            rows, errors, count = [], [], 0
+    if count:
+        yield rows, errors, count
+
+
+class ProductImporter:
+    """Streams csv/ndjson product rows into the products table.
+
+    Parsing and validation run in the threadpool a chunk at a time, so memory stays flat whatever
+    the file size. Each chunk is checked against categories, COPY'd into a temp staging table and
+    upserted on id, then committed on its own: a failing chunk is reported and the rest still load.
+    """
+
+    def __init__(self, db: AsyncSession, chunk_size: Optional[int] = None):
+        self.db = db
+        self.chunk_size = chunk_size or config.product_import_chunk_size
+        self.report = ProductImportReport()
+        self._categories: Set[UUID] = set()
+
+    async def run(self, stream: IO[str], fmt: str) -> ProductImportReport:
+        chunks = _parse_chunks(stream, fmt, self.chunk_size)
+        while True:
+            chunk = await run_in_threadpool(next, chunks, None)
+            if chunk is None:
+                return self.report
+            rows, errors, count = chunk
+            self.report.total += count
+            for error in errors:
+                self._fail(error)
+            rows = await self._check_categories(rows)
+            if rows:
+                await self._load(rows)
+
+    def _fail(self, error: dict):
+        self.report.failed += 1
+        if len(self.report.errors) < config.product_import_max_errors:
+            self.report.errors.append(error)
+
+    async def _check_categories(self, rows: List[Tuple[int, tuple]]) -> List[Tuple[int, tuple]]:
+        unknown = {record[6] for _, record in rows} - self._categories
+        if unknown:
+            found = await self.db.scalars(select(Category.id).where(Category.id.in_(unknown)))
+            self._categories.update(found)
+        checked = []
+        for line, record in rows:
+            if record[6] in self._categories:
+                checked.append((line, record))
+            else:
+                self._fail({"row": line, "error": "Kategori bulunamadı."})
+        return checked
+
+    async def _load(self, rows: List[Tuple[int, tuple]]):
+        # a repeated id inside one chunk would make the upsert touch a row twice; the last occurrence wins
+        kept = {}
+        for line, record in rows:
+            if record[0] in kept:
+                self._fail({"row": kept[record[0]][0], "error": "Aynı id tekrar edildi, sonraki satır kullanıldı."})
+            kept[record[0]] = (line, record)
+        records = [record for _, record in kept.values()]
+        try:
+            await self.db.execute(CreateTable(staging, if_not_exists=True))
+            connection = await self.db.connection()
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(staging.name, records=records, columns=COLUMNS)
+            await self.db.execute(_upsert_statement())
+            # imported stock levels of hot products are split across their shards
+            await spread_stock(self.db, [record[0] for record in records])
+            if config.product_search_backend == "memory":
+                after_commit(self.db, partial(product_index.bulk_load, [record[:3] for record in records]))
+            invalidate_all(self.db)
+            invalidate_tree(self.db)
+            await self.db.commit()
+        except Exception as exc:
+            await self.db.rollback()
+            message = str(getattr(exc, "orig", exc))
+            for line, _ in kept.values():
+                self._fail({"row": line, "error": message})
+            return
+        self.report.imported += len(records)
+
+
+def _upsert_statement():
+    now = func.timezone("utc", func.now())
+    # rows without is_active keep the existing product's flag and insert active ones; resolved in the select,
+    # since a NULL would fail the NOT NULL check before the conflict is even found
+    existing = Product.__table__.alias("existing")
+    values = [
+        func.coalesce(staging.c.is_active, existing.c.is_active, true()) if name == "is_active" else staging.c[name]
+        for name in COLUMNS
+    ]
+    stmt = insert(Product).from_select(
+        [*COLUMNS, "created_at", "updated_at"],
+        select(*values, now, now).outerjoin(existing, existing.c.id == staging.c.id),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[Product.id],
+        set_={name: stmt.excluded[name] for name in (*COLUMNS[1:], "updated_at")},
+    )
+
+
+async def import_products(db: AsyncSession, binary: IO[bytes], fmt: str,
+                          chunk_size: Optional[int] = None) -> ProductImportReport:
+    if fmt not in FORMATS:
+        raise BadRequestError("Desteklenmeyen dosya biçimi, csv veya ndjson yükleyiniz.")
+    stream = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    try:
+        return await ProductImporter(db, chunk_size).run(stream, fmt)
+    finally:
+        stream.detach()
+
+
+async def main(path: str, fmt: Optional[str], chunk_size: Optional[int]):
+    fmt = fmt or detect_format(path)
+    with open(path, "rb") as binary:
+        async with get_db() as db:
+            report = await import_products(db, binary, fmt, chunk_size)
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import products from a csv or ndjson file.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--chunk-size", type=int)
+    args = parser.parse_args()
+    asyncio.run(main(args.path, args.format, args.chunk_size))
@@ -1,112 +1,224 @@
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, Tuple
+
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import ForeignKey, select
+from sqlalchemy import ForeignKey, Index, Computed, String, any_, bindparam, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
 
 from src.product.schemas import ProductCreate, ProductUpdate
-from src.utils.single_psql_db import Base, get_db
+from src.settings import config
+from src.utils.inverted_index import InvertedIndex
+from src.utils.single_psql_db import Base, after_commit
 from src.utils.exceptions import NotFoundError
 
 
+SEARCH_CONFIG = "simple"
+
+# used when config.product_search_backend == "memory"
+product_index = InvertedIndex()
+
+
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_updated_at_id", "updated_at", "id"),
+        Index("ix_products_category_id_updated_at", "category_id", "updated_at", "id"),
+        # facet filters: category + price range (stock included for the in-stock facet), price range alone,
+        # and in-stock listings in the default updated_at order
+        Index("ix_products_category_id_price", "category_id", "price", "stock"),
+        Index("ix_products_price", "price"),
+        Index("ix_products_in_stock_updated_at", "updated_at", "id", postgresql_where=text("stock > 0")),
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+    )
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     title: Mapped[str] = mapped_column(nullable=False)
     description: Mapped[str] = mapped_column(nullable=False)
     price: Mapped[float] = mapped_column(nullable=False)
     stock: Mapped[int] = mapped_column(nullable=False)
+    # 0: stock lives in this row. N > 0 (hot products): checkouts draw from N ProductStockShard rows and
+    # stock mirrors their sum, refreshed by the rebalancer
+    stock_shards: Mapped[int] = mapped_column(nullable=False, default=0, server_default=text("0"))
     is_active: Mapped[bool] = mapped_column(nullable=False, default=True)
     category_id: Mapped[UUID] = mapped_column(ForeignKey("categories.id"), nullable=False)
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
+
+    @classmethod
+    async def create(cls, db: AsyncSession, product: ProductCreate):
+        new_product = Product(**product.model_dump(exclude_none=True))
+        db.add(new_product)
+        await db.flush()
+        await db.refresh(new_product)
+        cls._index_after_commit(db, new_product)
+        return new_product
+
+    @classmethod
+    async def get(cls, db: AsyncSession, product_id: UUID):
+        stmt = select(cls).where(cls.id == product_id)
+        product = await db.scalar(stmt)
+        return product
+
+    @classmethod
+    async def get_version(cls, db: AsyncSession, product_id: UUID) -> Optional[Tuple[datetime, int]]:
+        # reads the version columns only, no ORM object is built; checkouts change stock without bumping updated_at
+        return (await db.execute(select(cls.updated_at, cls.stock).where(cls.id == product_id))).first()
 
     @classmethod
-    async def create(cls, product: ProductCreate):
-        async with get_db() as db:
-            new_product = Product(**product.model_dump(exclude_none=True))
-            db.add(new_product)
-            await db.commit()
-            await db.refresh(new_product)
-            return new_product
+    async def touch(cls, db: AsyncSession, product_id: UUID):
+        # for changes stored outside the row (photos) that still change the product's representation
+        await db.execute(update(cls).where(cls.id == product_id).values(updated_at=datetime.utcnow()))
 
     @classmethod
-    async def get(cls, product_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == product_id)
-            product = await db.scalar(stmt)
-            return product
+    async def update(cls, db: AsyncSession, id: UUID, data: ProductUpdate):
+        stmt = select(cls).where(cls.id == id)
+        instance = await db.scalar(stmt)
+        if instance is None:
+            raise NotFoundError("Ürün bulunamadı.")
+        for key, value in data.dict().items():
+            setattr(instance, key, value)
+        await db.flush()
+        await db.refresh(instance)
+        cls._index_after_commit(db, instance)
+        return instance
 
     @classmethod
-    async def update(cls, id: UUID, data: ProductUpdate):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == id)
-            instance = await db.scalar(stmt)
-            if instance is None:
-                raise NotFoundError("Ürün bulunamadı.")
-            for key, value in data.dict().items():
-                setattr(instance, key, value)
-            await db.commit()
-            await db.refresh(instance)
-            return instance
+    async def delete(cls, db: AsyncSession, product_id: UUID):
+        stmt = select(cls).where(cls.id == product_id)
+        product = await db.scalar(stmt)
+        await db.delete(product)
+        await db.flush()
+        if config.product_search_backend == "memory":
+            after_commit(db, partial(product_index.remove, product_id))
+        return product
 
     @classmethod
-    async def delete(cls, product_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == product_id)
-            product = await db.scalar(stmt)
-            await db.delete(product)
-            await db.commit()
-            return product
+    def _index_after_commit(cls, db: AsyncSession, product: "Product"):
+        if config.product_search_backend == "memory":
+            after_commit(db, partial(product_index.upsert, product.id, product.title, product.description))
 
     @classmethod
-    async def get_by_category(cls, category_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.category_id == category_id)
-            products = await db.execute(stmt)
-            return products
+    async def sync_search_index(cls, db: AsyncSession, since: Optional[datetime] = None) -> Optional[datetime]:
+        # streams (id, title, description) rows changed since `since` (all rows when None) into product_index
+        # and returns the newest updated_at seen, to be passed back on the next call. updated_at is stamped at
+        # flush, not at commit, so a write committing after a sync already went past its stamp would be missed:
+        # every call reads the product_search_sync_lag_seconds before `since` again
+        stmt = select(cls.id, cls.title, cls.description, cls.updated_at).execution_options(yield_per=5000)
+        if since is not None:
+            stmt = stmt.where(cls.updated_at >= since - timedelta(seconds=config.product_search_sync_lag_seconds))
+        latest = since
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            for row in rows:
+                product_index.upsert(row.id, row.title, row.description)
+                if latest is None or row.updated_at > latest:
+                    latest = row.updated_at
+        return latest
 
     @classmethod
-    async def get_by_title(cls, title: str):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.title == title)
-            product = await db.scalar(stmt)
-            return product
+    async def reconcile_search_index(cls, db: AsyncSession) -> int:
+        # drops products deleted by other workers, whose after_commit only reached their own index; the keys are
+        # taken before the scan, so a product indexed while it runs is never mistaken for a deleted one
+        indexed = set(product_index.keys())
+        result = await db.stream_scalars(select(cls.id).execution_options(yield_per=5000))
+        async for product_id in result:
+            indexed.discard(product_id)
+        for product_id in indexed:
+            product_index.remove(product_id)
+        return len(indexed)
+
+    @classmethod
+    async def get_by_category(cls, db: AsyncSession, category_id: UUID):
+        stmt = select(cls).where(cls.category_id == category_id)
+        products = await db.execute(stmt)
+        return products
+
+    @classmethod
+    async def get_by_title(cls, db: AsyncSession, title: str):
+        stmt = select(cls).where(cls.title == title)
+        product = await db.scalar(stmt)
+        return product
 
 
 class ProductPhotos(Base):
     __tablename__ = "product_photos"
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
-    product_id: Mapped[UUID] = mapped_column(ForeignKey("products.id"), nullable=False)
+    product_id: Mapped[UUID] = mapped_column(ForeignKey("products.id"), nullable=False, index=True)
     url: Mapped[str] = mapped_column(nullable=False)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    # {"thumb": {"webp": <file>, "jpeg": <file>, "width": .., "height": ..}, "card": .., "detail": ..}
+    variants: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)
 
     @classmethod
-    async def create(cls, product_id: UUID, url: str):
-        async with get_db() as db:
-            new_photo = ProductPhotos(product_id=product_id, url=url)
-            db.add(new_photo)
-            await db.commit()
-            await db.refresh(new_photo)
-            return new_photo
+    async def create(cls, db: AsyncSession, product_id: UUID, url: str, content_hash: Optional[str] = None,
+                     variants: Optional[dict] = None):
+        new_photo = ProductPhotos(product_id=product_id, url=url, content_hash=content_hash, variants=variants)
+        db.add(new_photo)
+        await db.flush()
+        await db.refresh(new_photo)
+        return new_photo
 
     @classmethod
-    async def get(cls, photo_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == photo_id)
-            photo = await db.scalar(stmt)
-            return photo
+    async def get(cls, db: AsyncSession, photo_id: UUID):
+        stmt = select(cls).where(cls.id == photo_id)
+        photo = await db.scalar(stmt)
+        return photo
 
     @classmethod
-    async def get_by_product(cls, product_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.product_id == product_id)
-            photos = await db.execute(stmt)
-            return photos
+    async def get_by_hash(cls, db: AsyncSession, product_id: UUID, content_hash: str):
+        stmt = select(cls).where(cls.product_id == product_id, cls.content_hash == content_hash)
+        return await db.scalar(stmt)
 
     @classmethod
-    async def delete(cls, photo_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == photo_id)
-            photo = await db.scalar(stmt)
-            await db.delete(photo)
-            await db.commit()
-            return photo
+    async def get_variants_by_hash(cls, db: AsyncSession, content_hash: str) -> Optional[dict]:
+        # any product's row for the same content already points at the rendered files
+        stmt = select(cls.variants).where(cls.content_hash == content_hash, cls.variants.is_not(None)).limit(1)
+        return await db.scalar(stmt)
 
+    @classmethod
+    async def get_by_products(cls, db: AsyncSession, product_ids: list[UUID]) -> dict[UUID, list["ProductPhotos"]]:
+        # one round trip for a whole page; a single array parameter keeps the statement text (and its
+        # prepared statement) the same whatever the page size
+        photos = {product_id: [] for product_id in product_ids}
+        if not product_ids:
+            return photos
+        stmt = (
+            select(cls)
+            .where(cls.product_id == any_(bindparam("product_ids", list(product_ids), type_=ARRAY(PG_UUID))))
+            .order_by(cls.created_at, cls.id)
+        )
+        for photo in await db.scalars(stmt):
+            photos[photo.product_id].append(photo)
+        return photos
 
+    @classmethod
+    async def get_by_product(cls, db: AsyncSession, product_id: UUID):
+        stmt = select(cls).where(cls.product_id == product_id)
+        photos = await db.execute(stmt)
+        return photos
 
+    @classmethod
+    async def delete(cls, db: AsyncSession, photo_id: UUID):
+        stmt = select(cls).where(cls.id == photo_id)
+        photo = await db.scalar(stmt)
+        await db.delete(photo)
+        await db.flush()
+        return photo
+
+
+# one slice of a hot product's stock; concurrent checkouts lock different slices instead of one row
+class ProductStockShard(Base):
+    __tablename__ = "product_stock_shards"
+    product_id: Mapped[UUID] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    stock: Mapped[int] = mapped_column(nullable=False)
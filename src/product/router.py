@@ -1,20 +1,25 @@
-from pathlib import Path
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.auth.access.service import need_role
 from src.auth.current_user import get_current_user
+from src.product.cache import listing_cache, listing_key, listing_tags
+from src.product.exporter import MEDIA_TYPES
 from src.product.models import ProductPhotos
 
-from src.product.schemas import ProductCreate, ProductUpdate, PhotoResponse
-from src.product.service import ProductService
-from src.settings import config
+from src.product.schemas import ProductCreate, ProductUpdate, PhotoResponse, ProductSearchGet, ProductFilterGet, \
+    StockShardsUpdate
+from src.product.service import ProductService, photo_response
 from src.users.models import User
+from src.users.schemas import UserRole
 
-from src.utils.schemas import PaginationGet
-from src.utils.single_psql_db import get_db
+from src.utils.conditional import etag_headers, not_modified
+from src.utils.schemas import GeneralResponse
+from src.utils.single_psql_db import get_session
 
 product = APIRouter(
     prefix="/product",
@@ -24,48 +29,92 @@ product = APIRouter(
 
 
 @product.post("")
-async def create_product(product: ProductCreate, current_user: User = Depends(get_current_user)):
-    resp = await ProductService.product_create(product=product, actor=current_user)
+async def create_product(product: ProductCreate, current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.product_create(db, product=product, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
+@product.post("/import")
+async def import_products(file: UploadFile, current_user: User = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.import_products(db, file=file, actor=current_user)
+    return JSONResponse(status_code=resp.status, content=resp.model_dump())
+
+
+@product.get("/export")
+async def export_products(format: str = "ndjson", current_user: User = Depends(get_current_user)):
+    stream = ProductService.export_products(format, actor=current_user)
+    return StreamingResponse(stream, media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="products.{format}"'})
+
+
 @product.get("")
-async def get_products(pagination: PaginationGet = Depends()):
-    content = await ProductService.get_products(pagination)
+async def get_products(pagination: ProductFilterGet = Depends(), db: AsyncSession = Depends(get_session)):
+    key = listing_key(pagination)
+    body = listing_cache.get(key)
+    if body is not None:
+        return Response(content=body, media_type="application/json")
+    generation = listing_cache.generation
+    content = await ProductService.get_products(db, pagination)
+    response = JSONResponse(status_code=content.status, content=content.model_dump())
+    listing_cache.set(key, response.body, listing_tags(pagination, content.details.items), generation)
+    return response
+
+
+@product.get("/cache/stats")
+async def get_listing_cache_stats(current_user: User = Depends(get_current_user)):
+    need_role(current_user, [UserRole.ADMIN])
+    resp = GeneralResponse(status=200, message="Ürün listesi önbellek durumu", details=listing_cache.stats())
+    return JSONResponse(status_code=resp.status, content=resp.model_dump())
+
+
+@product.get("/search")
+async def search_products(search_data: ProductSearchGet = Depends(), db: AsyncSession = Depends(get_session)):
+    content = await ProductService.search_products(db, search_data)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @product.get("/{product_id}")
-async def get_product(product_id: UUID):
-    content = await ProductService.get_product(product_id=product_id)
-    return JSONResponse(status_code=content.status, content=content.model_dump())
+async def get_product(product_id: UUID, request: Request, db: AsyncSession = Depends(get_session)):
+    etag = await ProductService.get_product_etag(db, product_id=product_id)
+    if response := not_modified(request, etag):
+        return response
+    content = await ProductService.get_product(db, product_id=product_id)
+    return JSONResponse(status_code=content.status, content=content.model_dump(), headers=etag_headers(etag))
 
 
 @product.put("/{product_id}")
-async def update_product(product_id: UUID, data: ProductUpdate, current_user: User = Depends(get_current_user)):
-    resp = await ProductService.product_update(product_id=product_id, data=data, actor=current_user)
+async def update_product(product_id: UUID, data: ProductUpdate, current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.product_update(db, product_id=product_id, data=data, actor=current_user)
+    return JSONResponse(status_code=resp.status, content=resp.model_dump())
+
+
+@product.put("/{product_id}/stock-shards")
+async def set_stock_shards(product_id: UUID, data: StockShardsUpdate, current_user: User = Depends(get_current_user),
+                           db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.set_stock_shards(db, product_id=product_id, data=data, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @product.delete("/{product_id}")
-async def delete_product(product_id: UUID, current_user: User = Depends(get_current_user)):
-    resp = await ProductService.product_delete(product_id=product_id, actor=current_user)
+async def delete_product(product_id: UUID, current_user: User = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.product_delete(db, product_id=product_id, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
-@product.get("{product_id}/photos", response_model=list[PhotoResponse])
-async def get_room_photos(product_id: UUID):
-    async with get_db() as db:
-        result = await db.execute(select(ProductPhotos).where(ProductPhotos.product_id == product_id))
-        photos = result.scalars().all()
+@product.get("/{product_id}/photos", response_model=list[PhotoResponse])
+async def get_room_photos(product_id: UUID, db: AsyncSession = Depends(get_session)):
+    result = await db.execute(select(ProductPhotos).where(ProductPhotos.product_id == product_id))
+    photos = result.scalars().all()
 
-    return [
-        PhotoResponse(id=photo.id, url=f"{config.BASE_URL}/uploads/products/{Path(photo.url).name}")
-        for photo in photos
-    ]
+    return [photo_response(photo) for photo in photos]
 
 
 @product.post("/{product_id}/upload-photo")
-async def upload_photo(product_id: UUID, file: UploadFile, current_user: User = Depends(get_current_user)):
-    resp = await ProductService.upload_photo(product_id=product_id, file=file, actor=current_user)
+async def upload_photo(product_id: UUID, file: UploadFile, current_user: User = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_session)):
+    resp = await ProductService.upload_photo(db, product_id=product_id, file=file, actor=current_user)
     return JSONResponse(status_code=200, content=resp.model_dump())
@@ -1,10 +1,10 @@
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, SecretStr, field_validator
+from pydantic import BaseModel, EmailStr, SecretStr, Field, field_validator
 from typing import Optional, Union
 import bcrypt
 
-from src.utils.schemas import UUIDView
+from src.utils.schemas import PaginationGet, UUIDView
 
 
 class ProductCreate(BaseModel):
@@ -37,6 +37,36 @@ class ProductCreate(BaseModel):
         return value
 
 
+class ProductImport(ProductCreate):
+    # rows carrying an id update that product, rows without one are inserted
+    id: Optional[UUID] = None
+    # None keeps an existing product's flag; new products are active
+    is_active: Optional[bool] = None
+
+    @field_validator("stock")
+    def validate_stock(cls, value):
+        # a catalog sync carries sold out products too
+        if value < 0:
+            raise ValueError("Stok 0'ın altında olamaz.")
+        return value
+
+
+class ProductImportReport(BaseModel):
+    total: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: list[dict] = []
+
+
+class PhotoResponse(BaseModel):
+    id: Union[UUID, str]
+    url: str
+    variants: Optional[dict[str, dict[str, str]]] = None  # {"thumb": {"webp": url, "jpeg": url}, ...}
+
+    class Config:
+        from_attributes = True
+
+
 class ProductMiniView(BaseModel, UUIDView):
     title: str
     category_id: UUID
@@ -54,6 +84,7 @@ class ProductView(BaseModel, UUIDView):
     category_id: Union[UUID, str]
     stock: int
     is_active: bool
+    photos: list[PhotoResponse] = []
 
     class Config:
         orm_mode = True
@@ -61,6 +92,34 @@ class ProductView(BaseModel, UUIDView):
         from_attributes = True
 
 
+class ProductSearchView(ProductView):
+    description: str
+    score: float
+
+
+class ProductSearchGet(BaseModel):
+    q: str = Field(..., min_length=1, max_length=200)
+    page: Optional[int] = Field(default=1, ge=1)
+    pageSize: Optional[int] = Field(default=10, ge=1, le=100)
+
+
+class ProductFilterGet(PaginationGet):
+    category_id: Optional[UUID] = None  # includes subcategories
+    min_price: Optional[float] = Field(default=None, ge=0)
+    max_price: Optional[float] = Field(default=None, ge=0)
+    in_stock: Optional[bool] = None
+    is_active: Optional[bool] = None
+    facets: Optional[bool] = False
+
+    @property
+    def filtered(self) -> bool:
+        return any(value is not None for value in self.filter_key[:-1])
+
+    @property
+    def filter_key(self) -> tuple:
+        return self.category_id, self.min_price, self.max_price, self.in_stock, self.is_active, bool(self.facets)
+
+
 class ProductUpdate(BaseModel):
     title: Optional[str]
     description: Optional[str]
@@ -75,12 +134,6 @@ class ProductUpdate(BaseModel):
         from_attributes = True
 
 
-class PhotoResponse(BaseModel):
-    id: Union[UUID, str]
-    url: str
-
-    class Config:
-        from_attributes = True
-
-
-
+class StockShardsUpdate(BaseModel):
+    # 0 keeps the stock in the product row; hot products split it across this many counter rows
+    shards: int = Field(..., ge=0)
@@ -0,0 +1,35 @@
+import re
+from typing import Optional
+
+from sqlalchemy import func, or_, cast
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from src.product.models import Product, SEARCH_CONFIG
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def build_prefix_tsquery(text: str) -> Optional[str]:
+    # "kırmızı tel" -> "kırmızı:* & tel:*", so partially typed words still match
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_filter_and_score(text: str):
+    """Returns (where clause, score expression) for a ranked product search.
+
+    Matches either the weighted title/description tsvector (GIN) or trigram similarity on the title
+    (GIN, gin_trgm_ops) so typos still find results. Both branches are index backed.
+    """
+    similarity = func.similarity(Product.title, text)
+    trigram_match = Product.title.op("%")(text)
+
+    prefix_query = build_prefix_tsquery(text)
+    if prefix_query is None:
+        return trigram_match, similarity
+
+    tsquery = func.to_tsquery(cast(SEARCH_CONFIG, REGCONFIG), prefix_query)
+    rank = func.ts_rank_cd(Product.search_vector, tsquery)
+    return or_(Product.search_vector.op("@@")(tsquery), trigram_match), rank + similarity * 0.5
@@ -1,41 +1,109 @@
-import shutil
+import asyncio
+import logging
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from fastapi import UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.access.service import need_role
-from src.product.models import Product, ProductPhotos
-from src.product.schemas import ProductCreate, ProductView, ProductUpdate
+from src.category.tree import category_tree, product_moved
+from src.product.cache import invalidate_product
+from src.product.exporter import export_products
+from src.product.facets import compute_facets, filter_clauses
+from src.product.importer import FORMATS, detect_format, import_products
+from src.product.models import Product, ProductPhotos, product_index
+from src.product.schemas import ProductCreate, ProductView, ProductUpdate, ProductSearchGet, ProductSearchView, \
+    PhotoResponse, ProductFilterGet, StockShardsUpdate
+from src.product.search import search_filter_and_score
+from src.product.stock import rebalance_all, set_stock_shards, spread_stock
+from src.settings import config
 from src.users.models import User
 from src.users.schemas import UserRole
 
-from src.utils.single_psql_db import get_db
-from src.utils.pagination import get_pagination_info
-from src.utils.exceptions import NotFoundError
+from src.utils.pagination import get_pagination_info, get_cursor_pagination_info, apply_keyset, split_keyset_page
+from src.utils.exceptions import BadRequestError, NotFoundError
 from src.utils.schemas import GeneralResponse, PaginationGet, ListView
+from src.utils.conditional import version_etag
+from src.utils.single_psql_db import read_only, get_db
+from src.utils.images import FORMATS as IMAGE_FORMATS, generate_variants
+from src.utils.uploads import store_image
 
-from sqlalchemy import select
+from sqlalchemy import and_, select, func
 from uuid import UUID
 
 
+logger = logging.getLogger(__name__)
+
 UPLOAD_DIR = Path("uploads/products")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def photo_url(name: str) -> str:
+    return f"{config.BASE_URL}/uploads/products/{Path(name).name}"
+
+
+def photo_response(photo: ProductPhotos) -> PhotoResponse:
+    variants = None
+    if photo.variants:
+        variants = {
+            name: {fmt: photo_url(files[fmt]) for fmt in IMAGE_FORMATS}
+            for name, files in photo.variants.items()
+        }
+    return PhotoResponse(id=str(photo.id), url=photo_url(photo.url), variants=variants)
+
+
+def _product_dict(product: Product, photos: Optional[list] = None) -> dict:
+    return {
+        "id": str(product.id),
+        "title": product.title,
+        "description": product.description,
+        "category_id": str(product.category_id),
+        "price": product.price,
+        "stock": product.stock,
+        "is_active": product.is_active,
+        "created_at": int(product.created_at.timestamp() * 1000),
+        "updated_at": int(product.updated_at.timestamp() * 1000),
+        "photos": [photo_response(photo) for photo in photos or ()],
+    }
+
+
 class ProductService:
 
     @staticmethod
-    async def get_products(pagination_data: PaginationGet):
-        async with get_db() as db:
-            where_query = None
-            if pagination_data.search:
-                where_query = (
-                        (Product.title.like(f"%{pagination_data.search}%"))
-                )
-            if where_query is not None:
-                query = select(Product).where(where_query)
-            else:
-                query = select(Product)
+    @read_only
+    async def get_products(db: AsyncSession, pagination_data: ProductFilterGet, category_id: Optional[UUID] = None):
+        # the index ranks by relevance into offset pages; cursors, facets and the updated_at order need SQL
+        if (pagination_data.search and category_id is None and not pagination_data.filtered
+                and not (pagination_data.keyset or pagination_data.facets or pagination_data.order)
+                and config.product_search_backend == "memory"):
+            return await ProductService._get_products_from_index(db, pagination_data)
+        # base conditions apply to every facet; filter clauses are left out of their own facet's counts
+        base = []
+        if pagination_data.search:
+            base.append(Product.title.like(f"%{pagination_data.search}%"))
+        if category_id is not None:
+            base.append(Product.category_id == category_id)
+        if pagination_data.is_active is not None:
+            base.append(Product.is_active.is_(pagination_data.is_active))
+        category_ids = None
+        if pagination_data.category_id is not None:
+            tree = await category_tree.snapshot(db)
+            category_ids = tree.subtree_ids(pagination_data.category_id)
+        clauses = filter_clauses(pagination_data, category_ids)
+        base_query = and_(*base) if base else None
+        conditions = [*base, *clauses.values()]
+        where_query = and_(*conditions) if conditions else None
+
+        if where_query is not None:
+            query = select(Product).where(where_query)
+        else:
+            query = select(Product)
+        if pagination_data.keyset:
+            query = apply_keyset(query, Product, pagination_data)
+        else:
             if pagination_data.paginate:
                 query = query.limit(pagination_data.pageSize).offset(
                     (pagination_data.page - 1) * pagination_data.pageSize
@@ -43,68 +111,227 @@ class ProductService:
             if pagination_data.order:
                 query = query.order_by(Product.updated_at.desc())
 
-            products = await db.execute(query)
-            products = products.scalars().all()
-
-            product_views = []
-            for product in products:
-                product_dict = {
-                    "id": str(product.id),
-                    "title": product.title,
-                    "description": product.description,
-                    "category_id": str(product.category_id),
-                    "price": product.price,
-                    "stock": product.stock,
-                    "is_active": product.is_active,
-                    "created_at": int(product.created_at.timestamp() * 1000),
-                    "updated_at": int(product.updated_at.timestamp() * 1000)
-                }
-                product_views.append(product_dict)
-
-            count = await Product.get_count(where_query)
+        products = await db.execute(query)
+        products = products.scalars().all()
+        next_cursor = None
+        if pagination_data.keyset:
+            products, next_cursor = split_keyset_page(products, pagination_data)
+
+        photos = await ProductPhotos.get_by_products(db, [product.id for product in products])
+        product_views = [_product_dict(product, photos[product.id]) for product in products]
+
+        extra = {}
+        if pagination_data.facets:
+            # the facet pass also yields the exact filtered total, so no separate count query
+            extra["facets"], count = await compute_facets(db, base_query, clauses)
+            exact = True
+        else:
+            count, exact = await Product.get_total(db, where_query)
+        if pagination_data.keyset:
+            pagination_info = get_cursor_pagination_info(count, pagination_data, len(products), next_cursor, exact)
+        else:
             pagination_info = get_pagination_info(
                 total_items=count,
                 current_page=pagination_data.page,
-                page_size=pagination_data.pageSize
+                page_size=pagination_data.pageSize,
+                exact=exact
             )
 
-            return GeneralResponse(status=200,message="Ürünler Listelendi",details=ListView[ProductView](items=product_views, info=pagination_info))
+        return GeneralResponse(status=200,message="Ürünler Listelendi",details=ListView[ProductView](items=product_views, info=pagination_info, **extra))
+
+    @staticmethod
+    async def _get_products_from_index(db: AsyncSession, pagination_data: PaginationGet):
+        # matching and ranking happen in product_index; the database only loads the rows of the requested page
+        ranked = product_index.search(pagination_data.search)
+        page_ids = [product_id for product_id, _ in ranked]
+        if pagination_data.paginate:
+            start = (pagination_data.page - 1) * pagination_data.pageSize
+            page_ids = page_ids[start:start + pagination_data.pageSize]
+
+        products = {}
+        if page_ids:
+            rows = await db.scalars(select(Product).where(Product.id.in_(page_ids)))
+            products = {product.id: product for product in rows}
+        # a product deleted by another worker may still be indexed until the next sync; it is simply skipped
+        photos = await ProductPhotos.get_by_products(db, list(products))
+        product_views = [
+            _product_dict(products[product_id], photos[product_id]) for product_id in page_ids if product_id in products
+        ]
+
+        pagination_info = get_pagination_info(
+            total_items=len(ranked),
+            current_page=pagination_data.page,
+            page_size=pagination_data.pageSize,
+            exact=True
+        )
+        return GeneralResponse(status=200,message="Ürünler Listelendi",details=ListView[ProductView](items=product_views, info=pagination_info))
+
+    @staticmethod
+    async def build_search_index():
+        async with get_db() as db:
+            return await Product.sync_search_index(db)
+
+    @staticmethod
+    async def sync_search_index(since: Optional[datetime]):
+        # picks up writes made by other workers; this worker's own writes already reached the index via after_commit
+        reconciled = time.monotonic()
+        while True:
+            await asyncio.sleep(config.product_search_sync_seconds)
+            try:
+                async with get_db() as db:
+                    since = await Product.sync_search_index(db, since)
+                    if time.monotonic() - reconciled >= config.product_search_reconcile_seconds:
+                        removed = await Product.reconcile_search_index(db)
+                        reconciled = time.monotonic()
+                        if removed:
+                            logger.info("dropped %d deleted products from the search index", removed)
+            except Exception:
+                logger.exception("product search index sync failed")
+
+    @staticmethod
+    @read_only
+    async def search_products(db: AsyncSession, search_data: ProductSearchGet):
+        where_query, score = search_filter_and_score(search_data.q)
+        query = (
+            select(Product, score.label("score"), func.count().over().label("total"))
+            .where(where_query, Product.is_active.is_(True))
+            .order_by(score.desc(), Product.id)
+            .limit(search_data.pageSize)
+            .offset((search_data.page - 1) * search_data.pageSize)
+        )
+        rows = (await db.execute(query)).all()
+
+        items = [
+            ProductSearchView(
+                id=str(product.id),
+                title=product.title,
+                description=product.description,
+                category_id=str(product.category_id),
+                price=product.price,
+                stock=product.stock,
+                is_active=product.is_active,
+                score=round(float(row_score), 4),
+            ) for product, row_score, _ in rows
+        ]
+        # the window count rides along with the page; an empty page past the end falls back to 0
+        total = rows[0].total if rows else 0
+        pagination_info = get_pagination_info(
+            total_items=total,
+            current_page=search_data.page,
+            page_size=search_data.pageSize
+        )
+        return GeneralResponse(status=200, message="Arama Sonuçları",
+                               details=ListView[ProductSearchView](items=items, info=pagination_info))
 
     @staticmethod
-    async def get_product(product_id: UUID):
-        product = await Product.get(product_id)
+    @read_only
+    async def get_product_etag(db: AsyncSession, product_id: UUID) -> Optional[str]:
+        version = await Product.get_version(db, product_id)
+        return version_etag(product_id, *version) if version else None
+
+    @staticmethod
+    @read_only
+    async def get_product(db: AsyncSession, product_id: UUID):
+        product = await Product.get(db, product_id)
         if not product:
             raise NotFoundError("Ürün Bulunamadı")
-        return GeneralResponse(status=200, message="Ürün Bulundu", details=ProductView.model_validate(product))
+        photos = await ProductPhotos.get_by_products(db, [product.id])
+        return GeneralResponse(status=200, message="Ürün Bulundu",
+                               details=ProductView.model_validate(_product_dict(product, photos[product.id])))
 
     @staticmethod
-    async def product_create(product: ProductCreate, actor: User):
+    async def product_create(db: AsyncSession, product: ProductCreate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        await Product.create(product)
+        new_product = await Product.create(db, product)
+        invalidate_product(db, new_product.id, (new_product.title, new_product.description))
+        product_moved(db, None, new_product.category_id)
         return GeneralResponse(status=201, message="Ürün Başarıyla Oluşturuldu")
 
     @staticmethod
-    async def product_update(product_id: UUID, data: ProductUpdate, actor: User):
+    async def product_update(db: AsyncSession, product_id: UUID, data: ProductUpdate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        product = await Product.get(product_id)
+        product = await Product.get(db, product_id)
         if not product:
             raise NotFoundError("Ürün Bulunamadı")
-        await Product.update(id=product_id, data=data)
+        before, old_category_id = (product.title, product.description), product.category_id
+        old_stock = product.stock
+        product = await Product.update(db, id=product_id, data=data)
+        if product.stock_shards and product.stock != old_stock:
+            # a hot product's stock is the shards' sum; a new level is split across them again
+            await spread_stock(db, [product_id])
+        invalidate_product(db, product_id, before, (product.title, product.description))
+        product_moved(db, old_category_id, product.category_id)
         return GeneralResponse(status=200, message="Ürün Güncellendi")
 
     @staticmethod
-    async def product_delete(product_id: UUID, actor: User):
+    async def set_stock_shards(db: AsyncSession, product_id: UUID, data: StockShardsUpdate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        await Product.delete(product_id)
+        if data.shards > config.stock_max_shards:
+            raise BadRequestError(f"En fazla {config.stock_max_shards} stok parçası kullanılabilir.")
+        product = await set_stock_shards(db, product_id, data.shards)
+        return GeneralResponse(status=200, message="Stok Parçaları Güncellendi",
+                               details={"product_id": str(product.id), "stock_shards": product.stock_shards,
+                                        "stock": product.stock})
+
+    @staticmethod
+    async def rebalance_stock_shards():
+        # folds hot products' shards back into Product.stock and evens them out; while no product is
+        # sharded the check backs off, doubling up to stock_rebalance_idle_seconds
+        delay = config.stock_rebalance_seconds
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                async with get_db() as db:
+                    hot = await rebalance_all(db)
+                idle = min(delay * 2, max(config.stock_rebalance_idle_seconds, config.stock_rebalance_seconds))
+                delay = config.stock_rebalance_seconds if hot else idle
+            except Exception:
+                logger.exception("stock shard rebalance failed")
+
+    @staticmethod
+    async def product_delete(db: AsyncSession, product_id: UUID, actor: User):
+        need_role(actor, [UserRole.ADMIN])
+        product = await Product.delete(db, product_id)
+        invalidate_product(db, product_id, (product.title, product.description))
+        product_moved(db, product.category_id, None)
         return GeneralResponse(status=200, message="Ürün Silindi")
 
     @staticmethod
-    async def upload_photo(product_id: UUID, file: UploadFile, actor: User):
+    async def import_products(db: AsyncSession, file: UploadFile, actor: User):
+        need_role(actor, [UserRole.ADMIN])
+        fmt = detect_format(file.filename, file.content_type)
+        report = await import_products(db, file.file, fmt)
+        return GeneralResponse(status=200, message="Ürünler İçe Aktarıldı", details=report)
+
+    @staticmethod
+    def export_products(fmt: str, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        file_path = UPLOAD_DIR / f"{product_id}_{file.filename}"
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        await ProductPhotos.create(product_id=product_id, url=str(file_path))
-        return GeneralResponse(message="Fotoğraf Yüklendi", status=200, details=str({"file_path": str(file_path)}))
+        if fmt not in FORMATS:
+            raise BadRequestError("Desteklenmeyen dosya biçimi, csv veya ndjson seçiniz.")
+        return export_products(fmt)
+
+    @staticmethod
+    async def upload_photo(db: AsyncSession, product_id: UUID, file: UploadFile, actor: User):
+        need_role(actor, [UserRole.ADMIN])
+        if not await Product.get(db, product_id):
+            raise NotFoundError("Ürün Bulunamadı")
+        stored = await store_image(file, UPLOAD_DIR)
+        # the same image uploaded twice for one product keeps its single row
+        if not await ProductPhotos.get_by_hash(db, product_id, stored.content_hash):
+            variants = await ProductPhotos.get_variants_by_hash(db, stored.content_hash)
+            if variants is None:
+                try:
+                    variants = await generate_variants(stored.path, stored.content_hash)
+                except Exception:
+                    # right signature but undecodable content
+                    if stored.created:
+                        stored.path.unlink(missing_ok=True)
+                    raise BadRequestError("Görsel işlenemedi.")
+            await ProductPhotos.create(db, product_id=product_id, url=str(stored.path), content_hash=stored.content_hash,
+                                       variants=variants)
+            # photos are part of the product body, so its version (and ETag) moves with them
+            await Product.touch(db, product_id)
+            invalidate_product(db, product_id)
+        return GeneralResponse(message="Fotoğraf Yüklendi", status=200, details=str({"file_path": str(stored.path)}))
 
 
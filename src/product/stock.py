@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import random
+from typing import Dict, Iterable, List, Set
+from uuid import UUID
+
+from sqlalchemy import Integer, any_, bindparam, case, delete, func, insert, select, text, true, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.product.cache import invalidate_product
+from src.product.models import Product, ProductStockShard
+from src.settings import config
+from src.utils.exceptions import NotFoundError, OutOfStockError, StockBusyError
+
+logger = logging.getLogger(__name__)
+
+# deadlock_detected, lock_not_available (lock_timeout) and serialization_failure are safe to retry
+RETRYABLE = {"40P01", "55P03", "40001"}
+
+_ids = bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True)))
+
+
+class _Conflict(Exception):
+    # a line came back short although the stock is there: the product was sharded or unsharded mid-checkout
+    pass
+
+
+def _wanted():
+    return select(
+        func.unnest(_ids, bindparam("quantities", type_=ARRAY(Integer)))
+        .table_valued("product_id", "quantity")
+        .render_derived(with_types=False)
+    ).cte("wanted")
+
+
+def _reserve_statement():
+    """One statement for every unsharded cart line, so its shape (and prepared plan) does not depend on the cart size.
+
+    The materialized CTE locks the product rows in id order: two checkouts sharing products always
+    queue on the same first row instead of holding one each and deadlocking. The UPDATE then takes
+    the quantities off rows that still have enough stock and returns what it changed. updated_at is
+    kept: it orders the browse listings, and a purchase must not move the product to their top.
+    """
+    wanted = _wanted()
+    locked = (
+        select(Product.id)
+        .join(wanted, wanted.c.product_id == Product.id)
+        .where(Product.stock_shards == 0, Product.stock >= wanted.c.quantity)
+        .order_by(Product.id)
+        .with_for_update(of=Product)
+        .cte("locked")
+        .prefix_with("MATERIALIZED", dialect="postgresql")
+    )
+    return (
+        update(Product)
+        .where(Product.id == locked.c.id, Product.id == wanted.c.product_id, Product.stock >= wanted.c.quantity)
+        .values(stock=Product.stock - wanted.c.quantity, updated_at=Product.updated_at)
+        .returning(Product.id, Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _reserve_shard_statement():
+    """Takes each line off one random shard with capacity; shards other checkouts hold are skipped, not waited on."""
+    wanted = _wanted()
+    pick = (
+        select(ProductStockShard.shard)
+        .where(ProductStockShard.product_id == wanted.c.product_id, ProductStockShard.stock >= wanted.c.quantity)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .lateral("pick")
+    )
+    picked = (
+        select(wanted.c.product_id, pick.c.shard, wanted.c.quantity)
+        .select_from(wanted.join(pick, true()))
+        .cte("picked")
+        .prefix_with("MATERIALIZED", dialect="postgresql")
+    )
+    return (
+        update(ProductStockShard)
+        .where(ProductStockShard.product_id == picked.c.product_id, ProductStockShard.shard == picked.c.shard)
+        .values(stock=ProductStockShard.stock - picked.c.quantity)
+        .returning(ProductStockShard.product_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _take_statement():
+    # (product_id, shard, quantity) triples computed after locking every shard of the products
+    taken = select(
+        func.unnest(bindparam("product_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+                    bindparam("shards", type_=ARRAY(Integer)), bindparam("quantities", type_=ARRAY(Integer)))
+        .table_valued("product_id", "shard", "quantity")
+        .render_derived(with_types=False)
+    ).cte("taken")
+    return (
+        update(ProductStockShard)
+        .where(ProductStockShard.product_id == taken.c.product_id, ProductStockShard.shard == taken.c.shard)
+        .values(stock=ProductStockShard.stock - taken.c.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _spread_statement():
+    # rewrites the shards of ids from Product.stock: an even split, the remainder going to the lowest shards
+    return (
+        update(ProductStockShard)
+        .where(ProductStockShard.product_id == Product.id, Product.id == any_(_ids), Product.stock_shards > 0)
+        .values(stock=func.greatest(Product.stock, 0) // Product.stock_shards
+                + case((ProductStockShard.shard < func.greatest(Product.stock, 0) % Product.stock_shards, 1), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+_reserve = _reserve_statement()
+_reserve_shard = _reserve_shard_statement()
+_take = _take_statement()
+_spread = _spread_statement()
+
+
+def _params(quantities: Dict[UUID, int], ids: List[UUID]) -> dict:
+    return {"ids": ids, "quantities": [quantities[product_id] for product_id in ids]}
+
+
+async def _reserve_from_locked_shards(db: AsyncSession, quantities: Dict[UUID, int]) -> Set[UUID]:
+    """Slow path for hot lines no single free shard could serve: waits for every shard of the products,
+    locked in (product, shard) order, and takes each line across as many shards as it needs."""
+    rows = await db.execute(
+        select(ProductStockShard.product_id, ProductStockShard.shard, ProductStockShard.stock)
+        .where(ProductStockShard.product_id == any_(bindparam("ids", sorted(quantities), type_=ARRAY(PG_UUID))))
+        .order_by(ProductStockShard.product_id, ProductStockShard.shard)
+        .with_for_update()
+    )
+    shards: Dict[UUID, list] = {}
+    for product_id, shard, stock in rows:
+        shards.setdefault(product_id, []).append((shard, stock))
+
+    taken, reserved = {"product_ids": [], "shards": [], "quantities": []}, set()
+    for product_id, quantity in quantities.items():
+        slices = sorted(shards.get(product_id, ()), key=lambda item: -item[1])
+        if sum(stock for _, stock in slices) < quantity:
+            continue
+        for shard, stock in slices:
+            part = min(stock, quantity)
+            if part > 0:
+                taken["product_ids"].append(product_id)
+                taken["shards"].append(shard)
+                taken["quantities"].append(part)
+                quantity -= part
+            if quantity == 0:
+                break
+        reserved.add(product_id)
+    if taken["shards"]:
+        await db.execute(_take, taken)
+    return reserved
+
+
+async def _shortages(db: AsyncSession, quantities: Dict[UUID, int], reserved: Set[UUID]) -> List[dict]:
+    missing = [product_id for product_id in quantities if product_id not in reserved]
+    shard_total = (
+        select(func.coalesce(func.sum(ProductStockShard.stock), 0))
+        .where(ProductStockShard.product_id == Product.id)
+        .scalar_subquery()
+    )
+    rows = await db.execute(
+        select(Product.id, case((Product.stock_shards > 0, shard_total), else_=Product.stock))
+        .where(Product.id.in_(missing))
+    )
+    available = dict(rows.all())
+    return [
+        {"product_id": str(product_id), "requested": quantities[product_id],
+         "available": max(available.get(product_id, 0), 0)}
+        for product_id in missing
+    ]
+
+
+async def _reserve_lines(db: AsyncSession, quantities: Dict[UUID, int]) -> Dict[UUID, int]:
+    # unsharded lines in one statement, returning their new stock; whatever is left is either hot or short
+    ids = sorted(quantities)
+    plain = dict((await db.execute(_reserve, _params(quantities, ids))).all())
+    missing = [product_id for product_id in ids if product_id not in plain]
+    if not missing:
+        return plain
+    sharded = set(await db.scalars(_reserve_shard, _params(quantities, missing)))
+    missing = [product_id for product_id in missing if product_id not in sharded]
+    if missing:
+        sharded |= await _reserve_from_locked_shards(db, {product_id: quantities[product_id] for product_id in missing})
+    if len(plain) + len(sharded) != len(ids):
+        shortages = await _shortages(db, quantities, plain.keys() | sharded)
+        if all(line["available"] >= line["requested"] for line in shortages):
+            raise _Conflict()
+        raise OutOfStockError(details=shortages)
+    return plain
+
+
+async def reserve_stock(db: AsyncSession, quantities: Dict[UUID, int]):
+    """Takes quantities (product id -> count) off stock, all or nothing.
+
+    Runs in a savepoint of the caller's transaction, so the row locks are held until it commits and
+    a partial reservation never survives. Hot products (stock_shards > 0) are served from their
+    shards, so one SKU does not serialize every checkout. Raises OutOfStockError naming the short
+    lines, and StockBusyError when the rows stay locked through every retry.
+    """
+    attempts = max(config.stock_reserve_attempts, 1)
+    for attempt in range(1, attempts + 1):
+        try:
+            async with db.begin_nested():
+                if config.stock_lock_timeout_ms > 0:
+                    await db.execute(text(f"SET LOCAL lock_timeout = {int(config.stock_lock_timeout_ms)}"))
+                # leaving the block with an exception rolls the savepoint back, undoing the lines that did fit
+                changed = await _reserve_lines(db, quantities)
+                if config.stock_lock_timeout_ms > 0:
+                    await db.execute(text("SET LOCAL lock_timeout TO DEFAULT"))
+            break
+        except (DBAPIError, _Conflict) as exc:
+            if isinstance(exc, DBAPIError) and getattr(exc.orig, "sqlstate", None) not in RETRYABLE:
+                raise
+            logger.info("stock reservation attempt %d/%d failed: %r", attempt, attempts, getattr(exc, "orig", exc))
+            if attempt == attempts:
+                raise StockBusyError()
+            # jittered backoff, so retrying checkouts do not collide again in lockstep
+            await asyncio.sleep(random.uniform(0.01, 0.05) * attempt)
+
+    # hot products keep their Product.stock until the rebalancer folds the shards back. The order of the
+    # listings is unchanged, so only the pages showing the product are dropped, unless it just sold out:
+    # then in_stock filters and facet counts change on pages that never showed it
+    for product_id, stock in changed.items():
+        invalidate_product(db, product_id, reorder=stock <= 0)
+
+
+async def spread_stock(db: AsyncSession, product_ids: Iterable[UUID]):
+    """Overwrites the shards of hot products among product_ids with their current Product.stock, e.g. after
+    an admin or import sets a new stock level."""
+    await db.execute(_spread, {"ids": list(product_ids)})
+
+
+async def _fold(db: AsyncSession, product: Product, nowait: bool = False) -> int:
+    # locks the product's shards and writes their sum into Product.stock; returns the sum
+    stocks = await db.scalars(
+        select(ProductStockShard.stock)
+        .where(ProductStockShard.product_id == product.id)
+        .order_by(ProductStockShard.shard)
+        .with_for_update(nowait=nowait)
+    )
+    total = sum(stocks)
+    if product.stock != total:
+        # a stock-only change, written like reserve_stock's: updated_at and the listing order stay put; going
+        # in or out of stock still changes in_stock filtered pages and facet counts
+        crossed = (product.stock > 0) != (total > 0)
+        await db.execute(update(Product).where(Product.id == product.id)
+                         .values(stock=total, updated_at=Product.updated_at)
+                         .execution_options(synchronize_session=False))
+        set_committed_value(product, "stock", total)
+        invalidate_product(db, product.id, reorder=crossed)
+    return total
+
+
+async def set_stock_shards(db: AsyncSession, product_id: UUID, shards: int) -> Product:
+    """Turns sharded stock on (shards > 0), off (0) or re-splits it; the stock total is preserved."""
+    product = await db.scalar(select(Product).where(Product.id == product_id).with_for_update())
+    if product is None:
+        raise NotFoundError("Ürün bulunamadı.")
+    if product.stock_shards:
+        await _fold(db, product)
+        await db.execute(delete(ProductStockShard).where(ProductStockShard.product_id == product_id))
+    product.stock_shards = shards
+    await db.flush()
+    if shards:
+        series = func.generate_series(0, shards - 1).table_valued("shard")
+        await db.execute(insert(ProductStockShard).from_select(
+            ["product_id", "shard", "stock"], select(bindparam("product_id", product_id, type_=PG_UUID), series.c.shard, 0)
+        ))
+        await spread_stock(db, [product_id])
+    return product
+
+
+async def rebalance(db: AsyncSession, product_id: UUID):
+    """Folds a hot product's shards into Product.stock and evens them out again, so a checkout picking a random
+    shard keeps finding capacity. Shards busy in a checkout make it give up (lock_not_available) until the next round."""
+    product = await db.scalar(select(Product).where(Product.id == product_id, Product.stock_shards > 0))
+    if product is None:
+        return
+    await _fold(db, product, nowait=True)
+    await spread_stock(db, [product_id])
+
+
+async def rebalance_all(db: AsyncSession) -> int:
+    # one short transaction per hot product, so a busy one does not hold up the rest
+    product_ids = list(await db.scalars(select(Product.id).where(Product.stock_shards > 0)))
+    await db.commit()
+    for product_id in product_ids:
+        try:
+            await rebalance(db, product_id)
+            await db.commit()
+        except DBAPIError as exc:
+            await db.rollback()
+            if getattr(exc.orig, "sqlstate", None) not in RETRYABLE:
+                raise
+    return len(product_ids)
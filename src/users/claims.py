@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Optional, Set
+
+from jose import jwt
+from sqlalchemy import and_, delete, exists, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from src.cart.models import Cart, CartItem
+from src.order.models import Order
+from src.product.models import Product
+from src.settings import config
+from src.users.models import Address, User
+from src.utils.single_mongo_db import init_mongo_db
+from src.utils.single_psql_db import after_commit
+
+logger = logging.getLogger(__name__)
+
+# post-commit Mongo claims, referenced until they finish so the loop does not drop them
+_pending: Set[asyncio.Task] = set()
+
+
+async def _merge_cart(db: AsyncSession, user_id, session_token: str):
+    """Moves the session's cart into the user's: the whole cart when the user has none, else line by line with
+    quantities of a shared product added up. At most six statements whatever either cart holds."""
+    anonymous_id = await db.scalar(select(Cart.id).where(Cart.session_token == session_token).with_for_update())
+    if anonymous_id is None:
+        return
+    existing = aliased(Cart, name="existing")
+    claimed = await db.scalar(
+        update(Cart)
+        .where(Cart.id == anonymous_id, ~exists().where(existing.user_id == user_id))
+        .values(user_id=user_id, session_token=None)
+        .returning(Cart.id)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed:
+        return
+
+    user_cart_id = await Cart.upsert(db, user_id, None)
+    anonymous = aliased(CartItem, name="anonymous")
+    owned = aliased(CartItem, name="owned")
+    quantity_after = CartItem.quantity + anonymous.quantity
+    merged = (
+        update(CartItem)
+        .where(CartItem.cart_id == user_cart_id, anonymous.cart_id == anonymous_id,
+               anonymous.product_id == CartItem.product_id)
+        .values(quantity=quantity_after,
+                price=select(Product.price).where(Product.id == CartItem.product_id).scalar_subquery() * quantity_after,
+                updated_at=func.timezone("utc", func.now()))
+        .returning(CartItem.id)
+        .cte("merged")
+    )
+    # lines of products the user's cart lacks change carts and keep their ids
+    await db.execute(
+        update(CartItem)
+        .where(CartItem.cart_id == anonymous_id,
+               ~exists().where(and_(owned.cart_id == user_cart_id, owned.product_id == CartItem.product_id)))
+        .values(cart_id=user_cart_id)
+        .add_cte(merged)
+        .execution_options(synchronize_session=False)
+    )
+    # what is left are the lines folded into existing ones; the foreign key is checked at statement end
+    leftovers = delete(CartItem).where(CartItem.cart_id == anonymous_id).returning(CartItem.id).cte("leftovers")
+    await db.execute(delete(Cart).where(Cart.id == anonymous_id).add_cte(leftovers)
+                     .execution_options(synchronize_session=False))
+    await db.execute(
+        update(Cart)
+        .where(Cart.id == user_cart_id)
+        .values(total_price=select(func.coalesce(func.sum(CartItem.price), 0.0))
+                .where(CartItem.cart_id == user_cart_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _is_unique(session_token: str) -> bool:
+    # tokens issued before they carried a jti are the same for every visitor who arrived in the same second
+    try:
+        payload = jwt.decode(session_token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+    except jwt.JWTError:
+        return False
+    return "jti" in payload
+
+
+async def _claim_mongo_orders(owner: dict, session_token: str):
+    try:
+        mongo_db = await init_mongo_db()
+        if mongo_db is None:
+            return
+        await mongo_db.orders.update_many(
+            {"session_token": session_token, "user.user_id": None},
+            {"$set": {"session_token": None, **{f"user.{key}": value for key, value in owner.items()}}},
+        )
+    except Exception:
+        # the order documents only mirror the rows claimed in Postgres; a failure must not block the login
+        logger.exception("claiming anonymous order documents failed")
+
+
+def _schedule_mongo_claim(owner: dict, session_token: str):
+    task = asyncio.get_running_loop().create_task(_claim_mongo_orders(owner, session_token))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def claim_anonymous(db: AsyncSession, user: User, session_token: Optional[str]):
+    """Hands what the visitor built before signing in (cart, addresses, orders) over to user.
+
+    Runs in the login transaction with set based statements keyed on the indexed session_token
+    columns. The session token is cleared on everything claimed, so whoever uses the browser
+    after logout does not see it.
+    """
+    if not session_token or not _is_unique(session_token):
+        return
+    await _merge_cart(db, user.id, session_token)
+    await db.execute(
+        update(Address)
+        .where(Address.session_token == session_token)
+        .values(user_id=user.id, session_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(Order)
+        .where(Order.session_token == session_token, Order.user_id.is_(None))
+        .values(user_id=user.id, session_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    # the documents follow only once the rows above are committed; the user's fields are read now, since
+    # the instance expires at commit
+    owner = {"user_id": str(user.id), "username": user.username, "email": user.email, "is_anonymous": False}
+    after_commit(db, partial(_schedule_mongo_claim, owner, session_token))
@@ -1,10 +1,11 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, select
+from sqlalchemy import ForeignKey, Index, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID, uuid4
 
 from src.cart.models import Cart
 from src.order.models import Order
-from src.utils.single_psql_db import Base, get_db
+from src.utils.single_psql_db import Base
 from src.utils.exceptions import BadRequestError
 from src.users.schemas import UserCreate, UserUpdate, AddressCreate, UserRole
 from asyncpg.exceptions import UniqueViolationError
@@ -13,6 +14,9 @@ from sqlalchemy.exc import IntegrityError
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_updated_at_id", "updated_at", "id"),
+    )
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     username: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
@@ -28,67 +32,62 @@ class User(Base):
     addresses: Mapped[list["Address"]] = relationship("Address", back_populates="user")
 
     @classmethod
-    async def by_email(cls, email: str):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.email == email)
-            return await db.scalar(stmt)
+    async def by_email(cls, db: AsyncSession, email: str):
+        stmt = select(cls).where(cls.email == email)
+        return await db.scalar(stmt)
 
     @classmethod
-    async def get(cls, user_id: UUID):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == user_id)
-            return await db.scalar(stmt)
+    async def get(cls, db: AsyncSession, user_id: UUID):
+        stmt = select(cls).where(cls.id == user_id)
+        return await db.scalar(stmt)
 
     @classmethod
-    async def create(cls, user: UserCreate):
-        async with get_db() as db:
-            existing_email = await db.scalar(
-                select(cls).where(cls.email == user.email)
-            )
-            if existing_email:
-                raise BadRequestError("Bu e-posta adresi zaten kullanımda.")
-
-            existing_username = await db.scalar(
-                select(cls).where(cls.username == user.username)
-            )
-            if existing_username:
-                raise BadRequestError("Bu kullanıcı adı zaten kullanımda.")
-
-            new_user = User(**user.model_dump(exclude_none=True))
-            db.add(new_user)
-            await db.commit()
-            await db.refresh(new_user)
-            return new_user
+    async def create(cls, db: AsyncSession, user: UserCreate):
+        existing_email = await db.scalar(
+            select(cls).where(cls.email == user.email)
+        )
+        if existing_email:
+            raise BadRequestError("Bu e-posta adresi zaten kullanımda.")
+
+        existing_username = await db.scalar(
+            select(cls).where(cls.username == user.username)
+        )
+        if existing_username:
+            raise BadRequestError("Bu kullanıcı adı zaten kullanımda.")
+
+        new_user = User(**user.model_dump(exclude_none=True))
+        db.add(new_user)
+        await db.flush()
+        await db.refresh(new_user)
+        return new_user
 
     @classmethod
-    async def update(cls, user_id: UUID, user: UserUpdate):
-        async with get_db() as db:
-            stmt = select(cls).where(cls.id == user_id)
-            user_instance = await db.scalar(stmt)
+    async def update(cls, db: AsyncSession, user_id: UUID, user: UserUpdate):
+        stmt = select(cls).where(cls.id == user_id)
+        user_instance = await db.scalar(stmt)
 
-            if user_instance is None:
-                raise BadRequestError("Kullanıcı bulunamadı.")
+        if user_instance is None:
+            raise BadRequestError("Kullanıcı bulunamadı.")
 
-            update_data = user.model_dump(exclude_unset=True)
-            for key, value in update_data.items():
-                setattr(user_instance, key, value)
+        update_data = user.model_dump(exclude_unset=True)
+        for key, value in update_data.items():
+            setattr(user_instance, key, value)
 
-            await db.commit()
-            await db.refresh(user_instance)
-            return user_instance
+        await db.flush()
+        await db.refresh(user_instance)
+        return user_instance
 
     @classmethod
-    async def delete(cls, user_id: UUID):
-        async with get_db() as db:
-            user_instance = await db.scalar(select(cls).where(cls.id == user_id))
-            if user_instance is None:
-                raise BadRequestError("Kullanıcı bulunamadı.")
-            try:
-                await db.delete(user_instance)
-                await db.commit()
-                return user_instance
-            except (UniqueViolationError, IntegrityError):
-                raise BadRequestError("Kullanıcı silinemedi. İletişime geçiniz.")
+    async def delete(cls, db: AsyncSession, user_id: UUID):
+        user_instance = await db.scalar(select(cls).where(cls.id == user_id))
+        if user_instance is None:
+            raise BadRequestError("Kullanıcı bulunamadı.")
+        try:
+            await db.delete(user_instance)
+            await db.flush()
+            return user_instance
+        except (UniqueViolationError, IntegrityError):
+            raise BadRequestError("Kullanıcı silinemedi. İletişime geçiniz.")
 
 
 class Address(Base):
@@ -96,7 +95,7 @@ class Address(Base):
 
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"), nullable=True)
-    session_token: Mapped[str] = mapped_column(nullable=True)
+    session_token: Mapped[str] = mapped_column(nullable=True, index=True)
     name: Mapped[str] = mapped_column(nullable=False)
     title: Mapped[str] = mapped_column(nullable=False)
     country: Mapped[str] = mapped_column(nullable=False)
@@ -111,10 +110,9 @@ class Address(Base):
     orders: Mapped[list["Order"]] = relationship("Order", back_populates="address")
 
     @classmethod
-    async def create(cls, address_data: dict):
-        async with get_db() as db:
-            instance = cls(**address_data)
-            db.add(instance)
-            await db.commit()
-            await db.refresh(instance)
-            return instance
\ No newline at end of file
+    async def create(cls, db: AsyncSession, address_data: dict):
+        instance = cls(**address_data)
+        db.add(instance)
+        await db.flush()
+        await db.refresh(instance)
+        return instance
\ No newline at end of file
@@ -3,6 +3,7 @@ from uuid import UUID
 
 from fastapi import APIRouter, Depends, Request, Header, Cookie
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.current_user import get_current_user
 from src.users.models import User
@@ -10,6 +11,7 @@ from src.users.schemas import UserCreate, UserUpdate, AddressCreate
 from src.users.service import UserService
 from src.utils.exceptions import BadRequestError
 from src.utils.schemas import PaginationGet
+from src.utils.single_psql_db import get_session
 
 user = APIRouter(
     prefix="/users",
@@ -19,22 +21,25 @@ user = APIRouter(
 
 
 @user.post("")
-async def create_user(user: UserCreate, current_user: User = Depends(get_current_user)):
-    resp = await UserService.create(user=user, actor=current_user)
+async def create_user(user: UserCreate, current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_session)):
+    resp = await UserService.create(db, user=user, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @user.post("/address")
-async def create_address(address: AddressCreate, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
+async def create_address(address: AddressCreate, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                         db: AsyncSession = Depends(get_session)):
     if current_user is None and session_token is None:
         raise BadRequestError("Kullanıcı bilgisi bulunamadı!")
 
-    resp = await UserService.create_address(address=address, actor=current_user, session_token=session_token)
+    resp = await UserService.create_address(db, address=address, actor=current_user, session_token=session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @user.get("/addresses")
-async def get_addresses(request: Request, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None)):
+async def get_addresses(request: Request, current_user: Optional[User] = Depends(get_current_user), session_token: Optional[str] = Cookie(None),
+                        db: AsyncSession = Depends(get_session)):
     if current_user is None:
         try:
             current_user = await get_current_user(request=request)
@@ -44,35 +49,37 @@ async def get_addresses(request: Request, current_user: Optional[User] = Depends
     if not current_user and not session_token:
         raise BadRequestError("Kullanıcı bilgisi bulunamadı !")
 
-    resp = await UserService.get_address(actor=current_user, session_token=session_token)
+    resp = await UserService.get_address(db, actor=current_user, session_token=session_token)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @user.get("/addresses/{address_id}")
-async def get_address(address_id: UUID):
-    resp = await UserService.get_address_by_id(address_id)
+async def get_address(address_id: UUID, db: AsyncSession = Depends(get_session)):
+    resp = await UserService.get_address_by_id(db, address_id)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @user.get("")
-async def get_users(data: PaginationGet = Depends()):
-    content = await UserService.get_users(pagination_data=data)
+async def get_users(data: PaginationGet = Depends(), db: AsyncSession = Depends(get_session)):
+    content = await UserService.get_users(db, pagination_data=data)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @user.get("/users/{user_id}")
-async def get_user(user_id: UUID):
-    content = await UserService.get_user(user_id=user_id)
+async def get_user(user_id: UUID, db: AsyncSession = Depends(get_session)):
+    content = await UserService.get_user(db, user_id=user_id)
     return JSONResponse(status_code=content.status, content=content.model_dump())
 
 
 @user.put("/{user_id}")
-async def update_user(user_id: UUID, data: UserUpdate, current_user: User = Depends(get_current_user)):
-    resp = await UserService.update(user_id=user_id, data=data, actor=current_user)
+async def update_user(user_id: UUID, data: UserUpdate, current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_session)):
+    resp = await UserService.update(db, user_id=user_id, data=data, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
 
 
 @user.delete("/{user_id}")
-async def delete_user(user_id: UUID, current_user: User = Depends(get_current_user)):
-    resp = await UserService.delete(user_id=user_id, actor=current_user)
+async def delete_user(user_id: UUID, current_user: User = Depends(get_current_user),
+                      db: AsyncSession = Depends(get_session)):
+    resp = await UserService.delete(db, user_id=user_id, actor=current_user)
     return JSONResponse(status_code=resp.status, content=resp.model_dump())
\ No newline at end of file
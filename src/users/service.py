@@ -1,39 +1,42 @@
 from typing import Optional
 
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from src.auth.access.service import need_role
 from src.users.schemas import UserCreate, UserUpdate, UserView, UserRole, AddressCreate, AddressView
 from src.users.models import User, Address
 
-from src.utils.single_psql_db import get_db
-from src.utils.pagination import get_pagination_info
+from src.utils.pagination import get_pagination_info, get_cursor_pagination_info, apply_keyset, split_keyset_page
 from src.utils.exceptions import NotFoundError, BadRequestError
 from src.utils.schemas import GeneralResponse, PaginationGet, ListView
+from src.utils.single_psql_db import read_only
 
 
 class UserService:
 
     @staticmethod
-    async def create(user: UserCreate, actor: User):
+    async def create(db: AsyncSession, user: UserCreate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        async with get_db() as db:
-            await User.create(user=user)
-            return GeneralResponse(status=201, message="User created successfully.")
+        await User.create(db, user=user)
+        return GeneralResponse(status=201, message="User created successfully.")
 
     @staticmethod
-    async def get_users(pagination_data: PaginationGet):
-        async with get_db() as db:
-            where_query = None
-            if pagination_data.search:
-                where_query = (
-                    User.email.like(f"%{pagination_data.search}%")
-                )
-            if where_query is not None:
-                query = select(User).where(where_query)
-            else:
-                query = select(User)
+    @read_only
+    async def get_users(db: AsyncSession, pagination_data: PaginationGet):
+        where_query = None
+        if pagination_data.search:
+            where_query = (
+                User.email.like(f"%{pagination_data.search}%")
+            )
+        if where_query is not None:
+            query = select(User).where(where_query)
+        else:
+            query = select(User)
+        if pagination_data.keyset:
+            query = apply_keyset(query, User, pagination_data)
+        else:
             if pagination_data.paginate:
                 query = query.limit(pagination_data.pageSize).offset(
                     (pagination_data.page - 1) * pagination_data.pageSize
@@ -41,67 +44,66 @@ class UserService:
             if pagination_data.order:
                 query = query.order_by(User.updated_at.desc())
 
-            users = await db.scalars(query)
-            users = users.all()
+        users = await db.scalars(query)
+        users = users.all()
+        next_cursor = None
+        if pagination_data.keyset:
+            users, next_cursor = split_keyset_page(users, pagination_data)
 
-            user_views = [UserView.from_orm(user) for user in users]
+        user_views = [UserView.from_orm(user) for user in users]
 
-            count = await User.get_count(where_query)
+        count, exact = await User.get_total(db, where_query)
+        if pagination_data.keyset:
+            pagination_info = get_cursor_pagination_info(count, pagination_data, len(users), next_cursor, exact)
+        else:
             pagination_info = get_pagination_info(
                 total_items=count,
                 current_page=pagination_data.page,
-                page_size=pagination_data.pageSize
+                page_size=pagination_data.pageSize,
+                exact=exact
             )
 
-            return GeneralResponse(
-                status=200,
-                message="Users listed.",
-                details=ListView[UserView](info=pagination_info, items=user_views)
-            )
+        return GeneralResponse(
+            status=200,
+            message="Users listed.",
+            details=ListView[UserView](info=pagination_info, items=user_views)
+        )
 
     @staticmethod
-    async def get_user(user_id: UUID):
-        async with get_db() as db:
-            user = await User.get(user_id)
-            if not user:
-                raise NotFoundError("User not found.")
-            return GeneralResponse(status=200, message="User found.", details=UserView.model_validate(user))
+    @read_only
+    async def get_user(db: AsyncSession, user_id: UUID):
+        user = await User.get(db, user_id)
+        if not user:
+            raise NotFoundError("User not found.")
+        return GeneralResponse(status=200, message="User found.", details=UserView.model_validate(user))
 
     @staticmethod
-    async def update(user_id: UUID, data: UserUpdate, actor: User):
+    async def update(db: AsyncSession, user_id: UUID, data: UserUpdate, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        async with get_db() as db:
-            try:
-                user = await User.get(user_id)
-                if not user:
-                    raise NotFoundError("User not found.")
-
-                update_data = data.dict(exclude_unset=True)
-                for key, value in update_data.items():
-                    if hasattr(user, key):
-                        setattr(user, key, value)
-
-                db.add(user)
-                await db.commit()
-                return GeneralResponse(status=200, message="User updated successfully.")
-            except Exception as e:
-                return GeneralResponse(status=500, message=str(e))
+        user = await User.get(db, user_id)
+        if not user:
+            raise NotFoundError("User not found.")
+
+        update_data = data.dict(exclude_unset=True)
+        for key, value in update_data.items():
+            if hasattr(user, key):
+                setattr(user, key, value)
+
+        await db.flush()
+        return GeneralResponse(status=200, message="User updated successfully.")
 
     @staticmethod
-    async def delete(user_id: UUID, actor: User):
+    async def delete(db: AsyncSession, user_id: UUID, actor: User):
         need_role(actor, [UserRole.ADMIN])
-        async with get_db() as db:
-            try:
-                user = await User.get(user_id)
-                if not user:
-                    raise NotFoundError("User not found.")
-                await user.delete(user_id=user_id)
-                return GeneralResponse(status=200, message="User deleted successfully.")
-            except Exception as e:
-                return GeneralResponse(status=500, message=str(e))
+        user = await User.get(db, user_id)
+        if not user:
+            raise NotFoundError("User not found.")
+        await User.delete(db, user_id=user_id)
+        return GeneralResponse(status=200, message="User deleted successfully.")
 
     @staticmethod
-    async def create_address(address: AddressCreate, actor: Optional[User] = None, session_token: Optional[str] = None):
+    async def create_address(db: AsyncSession, address: AddressCreate, actor: Optional[User] = None,
+                             session_token: Optional[str] = None):
         address_data = address.dict()
 
         if actor:
@@ -111,7 +113,7 @@ class UserService:
         else:
             raise BadRequestError("Bir actor veya session_token sağlanmalı.")
 
-        created_address = await Address.create(address_data)
+        created_address = await Address.create(db, address_data)
 
         return GeneralResponse(
             status=201,
@@ -120,21 +122,20 @@ class UserService:
         )
 
     @staticmethod
-    async def get_address(actor: Optional[User] = None, session_token: Optional[str] = None):
-        async with get_db() as db:
-            if actor:
-                user_id = actor.id
-                address = await db.execute(select(Address).filter(Address.user_id == user_id))
-                address = address.scalars().first()
-            elif session_token:
-                address = await db.execute(select(Address).filter(Address.session_token == session_token))
-                address = address.scalars().first()
-
-                if not address:
-                    raise BadRequestError("Geçersiz session token.")
-            else:
-                raise BadRequestError(
-                    "Kullanıcı kimliği veya oturum belirteci sağlanmalıdır.")
+    async def get_address(db: AsyncSession, actor: Optional[User] = None, session_token: Optional[str] = None):
+        if actor:
+            user_id = actor.id
+            address = await db.execute(select(Address).filter(Address.user_id == user_id))
+            address = address.scalars().first()
+        elif session_token:
+            address = await db.execute(select(Address).filter(Address.session_token == session_token))
+            address = address.scalars().first()
+
+            if not address:
+                raise BadRequestError("Geçersiz session token.")
+        else:
+            raise BadRequestError(
+                "Kullanıcı kimliği veya oturum belirteci sağlanmalıdır.")
 
         if not address:
             raise NotFoundError("Adres bulunamadı.")
@@ -146,20 +147,13 @@ class UserService:
         )
 
     @staticmethod
-    async def get_address_by_id(id: UUID):
-        async with get_db() as db:
-            instance = await db.execute(select(Address).filter(Address.id == id))
-            instance = instance.scalar()
-            if not instance:
-                raise NotFoundError("Adres bulunamadı.")
-            return GeneralResponse(
-                status=200,
-                message="Adres başarıyla getirildi.",
-                details=AddressView.from_orm(instance)
-            )
-
-
-
-
-
-
+    async def get_address_by_id(db: AsyncSession, id: UUID):
+        instance = await db.execute(select(Address).filter(Address.id == id))
+        instance = instance.scalar()
+        if not instance:
+            raise NotFoundError("Adres bulunamadı.")
+        return GeneralResponse(
+            status=200,
+            message="Adres başarıyla getirildi.",
+            details=AddressView.from_orm(instance)
+        )
@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from src.utils.media import etag_matches
+
+# clients may store detail bodies but must revalidate them; a match costs a one column lookup and a 304
+REVALIDATE = "no-cache"
+
+
+def version_etag(id, updated_at: datetime, *extra) -> str:
+    # weak: the JSON body is derived from the row, not byte-identical across deployments
+    parts = [str(id), str(int(updated_at.timestamp() * 1_000_000)), *map(str, extra)]
+    return f'W/"{"-".join(parts)}"'
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    if etag is not None and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+    return None
+
+
+def etag_headers(etag: Optional[str]) -> Optional[dict]:
+    if etag is None:
+        return None
+    return {"ETag": etag, "Cache-Control": REVALIDATE}
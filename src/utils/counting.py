@@ -0,0 +1,57 @@
+from typing import Optional, Tuple
+
+from sqlalchemy import select, func, table, column, cast, BigInteger
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.settings import config
+from src.utils.cache import TTLCache
+
+__all__ = ["count_rows"]
+
+_pg_class = table("pg_class", column("oid"), column("reltuples"))
+
+_estimates = TTLCache(ttl=config.count_cache_ttl, max_entries=256)
+_filtered_counts = TTLCache(ttl=config.count_cache_ttl, max_entries=config.count_cache_size)
+
+
+async def _estimate_rows(db: AsyncSession, table_name: str) -> int:
+    estimate = _estimates.get(table_name)
+    if estimate is None:
+        stmt = select(cast(_pg_class.c.reltuples, BigInteger)).where(
+            _pg_class.c.oid == cast(table_name, postgresql.REGCLASS)
+        )
+        # reltuples is -1 until the table is first analyzed
+        estimate = max(await db.scalar(stmt) or 0, 0)
+        _estimates.set(table_name, estimate)
+    return estimate
+
+
+def _where_key(table_name: str, where_query) -> str:
+    compiled = where_query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    return f"{table_name}:{compiled}"
+
+
+async def count_rows(db: AsyncSession, model, where_query: Optional[object] = None) -> Tuple[int, bool]:
+    """Returns (total, exact).
+
+    Small tables are always counted exactly. Unfiltered counts on large tables use the planner
+    estimate from pg_class, filtered ones are counted once and then served from a TTL cache.
+    """
+    table_name = model.__tablename__
+    query = select(func.count()).select_from(model)
+    if where_query is not None:
+        query = query.where(where_query)
+
+    if await _estimate_rows(db, table_name) < config.count_exact_threshold:
+        return await db.scalar(query), True
+    if where_query is None:
+        return await _estimate_rows(db, table_name), False
+
+    key = _where_key(table_name, where_query)
+    cached = _filtered_counts.get(key)
+    if cached is not None:
+        return cached, False
+    total = await db.scalar(query)
+    _filtered_counts.set(key, total)
+    return total, True
@@ -49,3 +49,19 @@ class BadRequestError(GeneralException):
                  code: Optional[str] = "BadRequestException",
                  details: Optional[Any] = None, headers: Optional[Dict[str, str]] = None):
         super().__init__(message, status, code, details, headers)
+
+
+class OutOfStockError(GeneralException):
+
+    def __init__(self, message: Optional[str] = "Stokta yeterli ürün yok.", status: Optional[int] = 409,
+                 code: Optional[str] = "OutOfStockException",
+                 details: Optional[Any] = None, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message, status, code, details, headers)
+
+
+class StockBusyError(GeneralException):
+
+    def __init__(self, message: Optional[str] = "Stok şu an yoğun, lütfen tekrar deneyiniz.",
+                 status: Optional[int] = 503, code: Optional[str] = "StockBusyException",
+                 details: Optional[Any] = None, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message, status, code, details, headers or {"Retry-After": "1"})
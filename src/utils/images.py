@@ -0,0 +1,73 @@
+import asyncio
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from src.settings import config
+
+# name -> longest side in pixels; images smaller than a variant are not upscaled
+VARIANTS: Dict[str, int] = {"thumb": 160, "card": 480, "detail": 1200}
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def render_variants(source: str, content_hash: str) -> Dict[str, dict]:
+    """Writes <hash>_<variant>.<ext> next to source for every variant and format.
+
+    Runs in a worker process. Files that already exist are not encoded again, since the name is
+    derived from the source content; each is encoded to a temporary file and renamed into place, so
+    an existing name is always a complete file.
+    """
+    directory = Path(source).parent
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        for name, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            files = {}
+            for fmt, (encoder, options) in FORMATS.items():
+                path = directory / f"{content_hash}_{name}.{EXTENSIONS[fmt]}"
+                if not path.exists():
+                    # jpeg has no alpha channel
+                    output = resized.convert("RGB") if encoder == "JPEG" else resized
+                    temp_path = directory / f".{uuid.uuid4().hex}.part"
+                    try:
+                        output.save(temp_path, encoder, **options)
+                        os.replace(temp_path, path)
+                    finally:
+                        temp_path.unlink(missing_ok=True)
+                files[fmt] = path.name
+            variants[name] = {**files, "width": resized.width, "height": resized.height}
+    return variants
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=config.image_workers)
+    return _pool
+
+
+async def generate_variants(source: Path, content_hash: str) -> Dict[str, dict]:
+    # decoding and encoding are CPU bound and hold the GIL, so they go to a process pool, never the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), render_variants, str(source), content_hash)
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
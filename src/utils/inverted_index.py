@@ -0,0 +1,115 @@
+import math
+import re
+from array import array
+from bisect import bisect_left
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+__all__ = ["InvertedIndex", "tokenize", "normalize"]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_TURKISH_UPPER = str.maketrans({"I": "ı", "İ": "i"})
+
+
+def normalize(text: str) -> str:
+    # str.lower() maps "I" to "i" and "İ" to "i̇" (with a combining dot); Turkish wants "ı" and "i"
+    return text.translate(_TURKISH_UPPER).lower()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _WORD.findall(normalize(text))
+
+
+class InvertedIndex:
+    """In-memory BM25 index.
+
+    Documents get increasing integer ordinals, so every postings list is a sorted array('I') of ordinals
+    with a parallel array('H') of term frequencies; removal is a bisect plus a C-level delete.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, title_weight: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._ordinals: Dict[Hashable, int] = {}
+        self._keys: Dict[int, Hashable] = {}
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self._doc_len: Dict[int, int] = {}
+        self._next_ordinal = 0
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def keys(self) -> List[Hashable]:
+        return list(self._ordinals)
+
+    def clear(self):
+        self.__init__(self.k1, self.b, self.title_weight)
+
+    def upsert(self, key: Hashable, title: Optional[str], body: Optional[str] = None):
+        self.remove(key)
+        frequencies: Dict[str, int] = {}
+        for token in tokenize(title):
+            frequencies[token] = frequencies.get(token, 0) + self.title_weight
+        for token in tokenize(body):
+            frequencies[token] = frequencies.get(token, 0) + 1
+        if not frequencies:
+            return
+
+        ordinal = self._next_ordinal
+        self._next_ordinal += 1
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(ordinal)
+            postings[1].append(min(frequency, 0xFFFF))
+
+        length = sum(frequencies.values())
+        self._ordinals[key] = ordinal
+        self._keys[ordinal] = key
+        self._doc_terms[ordinal] = tuple(frequencies)
+        self._doc_len[ordinal] = length
+        self._total_len += length
+
+    def remove(self, key: Hashable):
+        ordinal = self._ordinals.pop(key, None)
+        if ordinal is None:
+            return
+        del self._keys[ordinal]
+        self._total_len -= self._doc_len.pop(ordinal)
+        for term in self._doc_terms.pop(ordinal):
+            ordinals, frequencies = self._postings[term]
+            position = bisect_left(ordinals, ordinal)
+            del ordinals[position]
+            del frequencies[position]
+            if not ordinals:
+                del self._postings[term]
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        doc_count = len(self._ordinals)
+        if not doc_count:
+            return []
+        average_len = self._total_len / doc_count
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            ordinals, frequencies = postings
+            idf = math.log(1 + (doc_count - len(ordinals) + 0.5) / (len(ordinals) + 0.5))
+            for ordinal, frequency in zip(ordinals, frequencies):
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[ordinal] / average_len)
+                scores[ordinal] = scores.get(ordinal, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(self._keys[ordinal], score) for ordinal, score in ranked]
+
+    def bulk_load(self, documents: Iterable[Tuple[Hashable, Optional[str], Optional[str]]]):
+        for key, title, body in documents:
+            self.upsert(key, title, body)
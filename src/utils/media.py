@@ -0,0 +1,182 @@
+"""Serving of uploaded media.
+
+The zero-copy path only runs on servers that advertise the http.response.zerocopysend extension;
+uvicorn does not, so under the default deployment every byte is read in chunks by Python. Production
+behind nginx (or apache/lighttpd) should set media_offload so the proxy sends the files itself.
+"""
+import os
+import re
+from email.utils import formatdate
+from mimetypes import guess_type
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# <sha256>.<ext> originals and <sha256>_<variant>.<ext> renditions never change once written
+CONTENT_ADDRESSED = re.compile(r"^(?P<hash>[0-9a-f]{64}(?:_[a-z]+)?)\.[a-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+ZEROCOPY = "http.response.zerocopysend"
+OFFLOAD_MODES = ("", "x-accel-redirect", "x-sendfile")  # the mode is also the response header name
+
+
+def _etag(name: str, stat_result: os.stat_result) -> Tuple[str, bool]:
+    match = CONTENT_ADDRESSED.match(name)
+    if match:
+        return f'"{match.group("hash")}"', True
+    # legacy {product_id}_{filename} uploads can be overwritten in place, so they are validated on every use
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"', False
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/ prefixes are ignored on both sides
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Returns the inclusive (start, end) of a single "bytes=" range, None to send the whole file.
+
+    Malformed and multi-range headers are ignored and answered with the whole file, which RFC 9110
+    allows. Raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, separator, last = header[len("bytes="):].strip().partition("-")
+    if not separator or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        if int(last) == 0:
+            raise ValueError("range not satisfiable")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class MediaFileResponse(Response):
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, stat_result: os.stat_result, scope: Scope, offload: Optional[Tuple[str, str]] = None):
+        self.path = path
+        self.start, self.end = 0, stat_result.st_size - 1
+        self.status_code = 200
+        self.media_type = None
+        self.background = None
+        self.init_headers()
+
+        request_headers = Headers(scope=scope)
+        size = stat_result.st_size
+        etag, immutable = _etag(os.path.basename(path), stat_result)
+        self.headers["etag"] = etag
+        self.headers["cache-control"] = IMMUTABLE if immutable else REVALIDATE
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-type"] = guess_type(path)[0] or "application/octet-stream"
+
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            self.status_code = 304
+            del self.headers["content-type"]
+            return
+
+        if_range = request_headers.get("if-range")
+        if if_range is None or if_range.strip() == etag:
+            try:
+                byte_range = parse_range(request_headers.get("range"), size)
+            except ValueError:
+                self.status_code = 416
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                return
+            if byte_range is not None:
+                self.start, self.end = byte_range
+                self.status_code = 206
+                self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+        if offload is not None:
+            # the proxy reads the file itself and applies the client's Range, so the upstream answer is an empty 200
+            header, value = offload
+            self.status_code = 200
+            self.headers[header] = value
+            self.headers["content-length"] = "0"
+            if "content-range" in self.headers:
+                del self.headers["content-range"]
+            self.start, self.end = 0, -1
+
+    @property
+    def has_body(self) -> bool:
+        return self.status_code in (200, 206) and self.end >= self.start
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or not self.has_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if ZEROCOPY in scope.get("extensions", {}):
+            await self.send_zerocopy(send)
+        else:
+            await self.send_file(send)
+
+    async def send_zerocopy(self, send: Send) -> None:
+        # the server hands the descriptor to sendfile(2): no file bytes pass through Python
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({"type": ZEROCOPY, "file": file, "offset": self.start, "count": self.end - self.start + 1,
+                        "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+    async def send_file(self, send: Send) -> None:
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining == 0:
+                    return
+        # empty file, or it shrank underneath us; close the body rather than hang the client
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles for uploads: strong ETags, immutable caching of content addressed names and byte ranges.
+
+    File bytes go out, in order of preference, through a reverse proxy (offload="x-accel-redirect" for
+    nginx, "x-sendfile" for apache/lighttpd), the ASGI zero-copy send extension when the server offers
+    it, or chunked reads in the threadpool.
+    """
+
+    def __init__(self, *args, offload: str = "", offload_prefix: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"unknown media offload mode {offload!r}")
+        self.offload = offload
+        self.offload_prefix = offload_prefix
+
+    def offload_header(self, full_path: str) -> Optional[Tuple[str, str]]:
+        if not self.offload:
+            return None
+        if self.offload == "x-sendfile":
+            return self.offload, os.path.abspath(full_path)
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        return self.offload, self.offload_prefix.rstrip("/") + "/" + quote(relative)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        full_path = str(full_path)
+        return MediaFileResponse(full_path, stat_result, scope, self.offload_header(full_path))
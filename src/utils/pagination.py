@@ -1,8 +1,18 @@
-from src.utils.schemas import PaginationInfo
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from uuid import UUID
 
-__all__ = ["get_pagination_info"]
+from sqlalchemy import tuple_
 
-def get_pagination_info(total_items: int, current_page: int, page_size: int):
+from src.utils.exceptions import BadRequestError
+from src.utils.schemas import PaginationInfo, PaginationGet
+
+__all__ = ["get_pagination_info", "get_cursor_pagination_info", "encode_cursor", "decode_cursor", "apply_keyset",
+           "split_keyset_page"]
+
+def get_pagination_info(total_items: int, current_page: int, page_size: int, exact: bool = True):
     total_pages = (total_items + page_size - 1) // page_size
     has_previous = current_page > 1
     has_next = current_page < total_pages
@@ -16,5 +26,52 @@ def get_pagination_info(total_items: int, current_page: int, page_size: int):
         pageCount=total_pages,
         pageSize=page_size,
         remainingPages=max(0, total_pages - current_page),
-        totalItems=total_items
+        totalItems=total_items,
+        totalExact=exact
     )
+
+
+def get_cursor_pagination_info(total_items: int, pagination_data: PaginationGet, items_count: int,
+                               next_cursor: Optional[str], exact: bool = True):
+    info = get_pagination_info(total_items, pagination_data.page, pagination_data.pageSize, exact)
+    info.currentPageSize = items_count
+    info.hasNext = next_cursor is not None
+    info.hasPrevious = pagination_data.after is not None
+    info.nextCursor = next_cursor
+    return info
+
+
+def encode_cursor(at: datetime, key: Any) -> str:
+    raw = json.dumps([at.isoformat(), str(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        at, key = json.loads(raw)
+        return datetime.fromisoformat(at), key
+    except (ValueError, TypeError):
+        raise BadRequestError("Geçersiz sayfa imleci.")
+
+
+def apply_keyset(query, model, pagination_data: PaginationGet):
+    # (updated_at, id) descending, served by the ix_<table>_updated_at_id index
+    if pagination_data.after:
+        at, key = decode_cursor(pagination_data.after)
+        try:
+            key = UUID(key)
+        except ValueError:
+            raise BadRequestError("Geçersiz sayfa imleci.")
+        query = query.where(tuple_(model.updated_at, model.id) < tuple_(at, key))
+    return query.order_by(model.updated_at.desc(), model.id.desc()).limit(pagination_data.pageSize + 1)
+
+
+def split_keyset_page(rows: List, pagination_data: PaginationGet,
+                      at_field: str = "updated_at") -> Tuple[List, Optional[str]]:
+    # apply_keyset fetches one extra row to learn whether a next page exists
+    if len(rows) <= pagination_data.pageSize:
+        return rows, None
+    rows = rows[:pagination_data.pageSize]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, at_field), last.id)
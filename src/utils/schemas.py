@@ -57,6 +57,8 @@ class PaginationInfo(BaseModel):
     pageSize: int
     remainingPages: int
     totalItems: int
+    totalExact: bool = True
+    nextCursor: typing.Optional[str] = None
 
 
 class ListView(BaseModel, typing.Generic[T], extra=Extra.allow):
@@ -70,6 +72,8 @@ class PaginationGet(BaseModel):
     paginate: typing.Optional[bool] = True
     search: typing.Optional[str] = None
     order: typing.Optional[bool] = None
+    cursor: typing.Optional[bool] = False
+    after: typing.Optional[str] = None
 
     @field_validator('page')
     def page_validator(cls, v):
@@ -77,6 +81,10 @@ class PaginationGet(BaseModel):
             raise ValueError("Sayfa 0'dan büyük olmalı.")
         return v
 
+    @property
+    def keyset(self) -> bool:
+        return bool(self.cursor or self.after)
+
 
 class ObjectIdPydanticAnnotation:
     @classmethod
@@ -1,16 +1,147 @@
 import contextlib
+import functools
+import logging
+import random
+import time
 
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
+from sqlalchemy.orm import DeclarativeBase, Session
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime
-from typing import Optional
-from sqlalchemy import select, func
+from typing import Optional, AsyncIterator, Callable
+from sqlalchemy import select, func, event, text, Select
+from fastapi import Request
 
-from src.settings import config
+from src.settings import config, Config
+from src.utils.counting import count_rows
 
-engine = create_async_engine(config.sql_uri, echo=True)
-SessionLocal = async_sessionmaker(bind=engine)
+sql_logger = logging.getLogger("src.sql")
+
+
+def build_engine(uri: str, settings: Config = config) -> AsyncEngine:
+    connect_args = {
+        "statement_cache_size": settings.sql_statement_cache_size,
+        "prepared_statement_cache_size": settings.sql_statement_cache_size,
+    }
+    if settings.sql_statement_timeout_ms > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.sql_statement_timeout_ms)}
+
+    new_engine = create_async_engine(
+        uri,
+        echo=False,
+        pool_size=settings.sql_pool_size,
+        max_overflow=settings.sql_max_overflow,
+        pool_timeout=settings.sql_pool_timeout,
+        pool_recycle=settings.sql_pool_recycle,
+        pool_pre_ping=settings.sql_pool_pre_ping,
+        connect_args=connect_args,
+    )
+    if settings.sql_echo_sample_rate > 0:
+        _install_sampled_logging(new_engine, settings.sql_echo_sample_rate)
+    return new_engine
+
+
+def _install_sampled_logging(target: AsyncEngine, rate: float):
+    # logs only a fraction of the statements, so logging can stay on under load
+    @event.listens_for(target.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context.sampled_at = time.perf_counter() if random.random() < rate else None
+
+    @event.listens_for(target.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "sampled_at", None)
+        if started is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            sql_logger.info("%.2f ms %s %r", elapsed, statement, parameters)
+
+
+def _engine_pool_status(target: AsyncEngine) -> dict:
+    pool = target.pool
+    return {
+        "size": pool.size(),
+        "checkedIn": pool.checkedin(),
+        "checkedOut": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "maxOverflow": config.sql_max_overflow,
+        "status": pool.status(),
+    }
+
+
+def pool_status() -> dict:
+    status = _engine_pool_status(engine)
+    status["replicas"] = [_engine_pool_status(replica) for replica in replica_engines]
+    return status
+
+
+engine = build_engine(config.sql_uri)
+replica_engines = [build_engine(uri) for uri in config.sql_replica_uris]
+
+# principal (auth token or session token) -> monotonic deadline until which its reads stay on the primary
+_recent_writes: dict[str, float] = {}
+
+
+def _mark_write(principal: Optional[str]):
+    if not principal or not replica_engines:
+        return
+    now = time.monotonic()
+    if len(_recent_writes) > 10000:
+        for key in [key for key, deadline in _recent_writes.items() if deadline < now]:
+            del _recent_writes[key]
+    _recent_writes[principal] = now + config.sql_read_your_writes_seconds
+
+
+def _wrote_recently(principal: Optional[str]) -> bool:
+    return principal is not None and _recent_writes.get(principal, 0) > time.monotonic()
+
+
+class RoutingSession(Session):
+    # SELECTs issued inside a read_only service method go to one replica per session,
+    # everything else (flushes, DML, text statements) goes to the primary.
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or (clause is not None and not isinstance(clause, Select)):
+            self.info["wrote"] = True
+            return engine.sync_engine
+        if isinstance(clause, Select) and replica_engines and self.info.get("read_only") \
+                and not self.info.get("wrote"):
+            if "replica" not in self.info:
+                self.info["replica"] = random.choice(replica_engines).sync_engine
+            return self.info["replica"]
+        return engine.sync_engine
+
+
+SessionLocal = async_sessionmaker(bind=engine, sync_session_class=RoutingSession)
+
+
+def after_commit(db: AsyncSession, callback: Callable[[], None]):
+    # runs callback once the surrounding transaction commits; dropped if it rolls back
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _run_after_commit(session: Session):
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception:
+            sql_logger.exception("after_commit callback failed")
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _drop_after_commit(session: Session):
+    session.info.pop("after_commit", None)
+
+
+def read_only(func):
+    # lets the wrapped service method read from a replica, unless the caller wrote recently
+    @functools.wraps(func)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        previous = db.info.get("read_only", False)
+        db.info["read_only"] = not _wrote_recently(db.info.get("principal"))
+        try:
+            return await func(db, *args, **kwargs)
+        finally:
+            db.info["read_only"] = previous
+    return wrapper
 
 
 class Base(DeclarativeBase):
@@ -21,13 +152,17 @@ class Base(DeclarativeBase):
         return f"<{self.__class__.__name__} {self.__dict__}>"
 
     @classmethod
-    async def get_count(cls, where_query: Optional[str] = None):
-        async with get_db() as db:
-            if where_query is None:
-                query = select(func.count()).select_from(cls)
-            else:
-                query = select(func.count()).select_from(cls).where(where_query)
-            return await db.scalar(query)
+    async def get_count(cls, db: AsyncSession, where_query: Optional[str] = None):
+        if where_query is None:
+            query = select(func.count()).select_from(cls)
+        else:
+            query = select(func.count()).select_from(cls).where(where_query)
+        return await db.scalar(query)
+
+    @classmethod
+    async def get_total(cls, db: AsyncSession, where_query: Optional[str] = None):
+        # (total, exact) for listings; large tables get estimated or cached totals
+        return await count_rows(db, cls, where_query)
 
 
 @contextlib.asynccontextmanager
@@ -42,7 +177,34 @@ async def get_db() -> AsyncSession:
         await db.close()
 
 
+def _request_principal(request: Request) -> Optional[str]:
+    authorization = request.headers.get("Authorization") or request.cookies.get("Authorization")
+    return authorization or request.cookies.get("session_token")
+
+
+async def get_session(request: Request) -> AsyncIterator[AsyncSession]:
+    # request scoped unit of work: auth, services and model helpers share this session,
+    # so a request checks out a single pooled connection and commits once at the end.
+    async with SessionLocal() as db:
+        db.info["principal"] = _request_principal(request)
+        try:
+            yield db
+            await db.commit()
+        except:
+            await db.rollback()
+            raise
+        if db.info.get("wrote"):
+            _mark_write(db.info["principal"])
+
+
 async def init_psql_db():
     async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
         print("psql db created.")
+
+
+async def close_psql_db():
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
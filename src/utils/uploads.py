@@ -0,0 +1,90 @@
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from src.settings import config
+from src.utils.exceptions import BadRequestError
+
+# leading bytes -> (extension, content type); the client supplied filename and content type are not trusted
+IMAGE_SIGNATURES: Dict[bytes, tuple] = {
+    b"\xff\xd8\xff": ("jpg", "image/jpeg"),
+    b"\x89PNG\r\n\x1a\n": ("png", "image/png"),
+    b"GIF87a": ("gif", "image/gif"),
+    b"GIF89a": ("gif", "image/gif"),
+}
+
+
+@dataclass
+class StoredFile:
+    path: Path
+    content_hash: str
+    size: int
+    content_type: str
+    created: bool  # False when an identical file was already stored
+
+
+def sniff_image(head: bytes) -> Optional[tuple]:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    for signature, kind in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def _write(handle, hasher, data: bytes):
+    # hashlib releases the GIL for large buffers, so hashing and writing both stay off the event loop
+    hasher.update(data)
+    handle.write(data)
+
+
+def _finish(temp_path: Path, path: Path) -> bool:
+    if path.exists():
+        temp_path.unlink()
+        return False
+    os.replace(temp_path, path)
+    return True
+
+
+async def store_image(file: UploadFile, directory: Path, max_bytes: Optional[int] = None) -> StoredFile:
+    """Copies an uploaded image into directory as <sha256>.<ext>, chunk by chunk in the threadpool.
+
+    Size and type are checked while copying; identical content is stored once and reused.
+    """
+    max_bytes = max_bytes or config.upload_max_bytes
+    if file.size is not None and file.size > max_bytes:
+        raise BadRequestError("Dosya boyutu sınırı aşıldı.", status=413)
+
+    hasher = hashlib.sha256()
+    temp_path = directory / f".{uuid.uuid4().hex}.part"
+    handle = await run_in_threadpool(temp_path.open, "wb")
+    size, kind = 0, None
+    try:
+        while chunk := await file.read(config.upload_chunk_size):
+            if kind is None:
+                kind = sniff_image(chunk)
+                if kind is None:
+                    raise BadRequestError("Desteklenmeyen dosya türü, jpeg, png, gif veya webp yükleyiniz.")
+            size += len(chunk)
+            if size > max_bytes:
+                raise BadRequestError("Dosya boyutu sınırı aşıldı.", status=413)
+            await run_in_threadpool(_write, handle, hasher, chunk)
+        if kind is None:
+            raise BadRequestError("Dosya boş.")
+    except BaseException:
+        await run_in_threadpool(handle.close)
+        await run_in_threadpool(temp_path.unlink, True)
+        raise
+    await run_in_threadpool(handle.close)
+
+    content_hash = hasher.hexdigest()
+    extension, content_type = kind
+    path = directory / f"{content_hash}.{extension}"
+    created = await run_in_threadpool(_finish, temp_path, path)
+    return StoredFile(path=path, content_hash=content_hash, size=size, content_type=content_type, created=created)